@@ -1,24 +1,319 @@
 # /// script
 # requires-python = ">=3.11"
 # dependencies = [
-#   "requests",
+#   "httpx",
 #   "fastapi",
-#   "uvicorn"
+#   "uvicorn",
+#   "python-dateutil",
+#   "numpy"
 # ]
 # ///
 
-import requests
+import httpx
+import asyncio
 import os
 import json
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Literal
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, Query
+from collections import OrderedDict, deque
+import hashlib
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse
-import subprocess
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
+from email.utils import formatdate, parsedate_to_datetime
+import mimetypes
+import codecs
+import zlib
+import gzip
+import io
+import base64
+import tarfile
+import zipfile
+from stat import S_ISREG
+from contextlib import asynccontextmanager, contextmanager
+import contextvars
 import logging
+import shutil
+import tempfile
+import time
+import re
+import sys
+import itertools
+import math
+import uuid
+import signal
+import sqlite3
+import numpy as np
+import ast
+import builtins
+import threading
+from datetime import datetime
+from dateutil.parser import parse as parse_date
+
+config = {
+    "root": "/data",
+    # /read streams files in chunks of this size and gzips larger responses
+    # for clients that accept it.
+    "read_chunk_size": int(os.getenv("READ_CHUNK_SIZE", str(64 * 1024))),
+    "read_gzip": os.getenv("READ_GZIP", "true").lower() in ("1", "true", "yes"),
+    "read_gzip_min_bytes": int(os.getenv("READ_GZIP_MIN_BYTES", "1024")),
+    "read_bulk_max_files": int(os.getenv("READ_BULK_MAX_FILES", "1000")),
+    "read_bulk_max_json_bytes": int(os.getenv("READ_BULK_MAX_JSON_BYTES", str(64 * 1024 * 1024))),
+    "read_bulk_concurrency": int(os.getenv("READ_BULK_CONCURRENCY", "16")),
+    # Connection pool of the shared LLM client. Keep-alive connections are reused
+    # across requests so only the first call pays for the TCP/TLS handshake.
+    "llm_max_connections": int(os.getenv("LLM_MAX_CONNECTIONS", "20")),
+    "llm_max_keepalive_connections": int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10")),
+    "llm_keepalive_expiry": float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60")),
+    "llm_timeout": float(os.getenv("LLM_TIMEOUT", "20")),
+    "llm_model": os.getenv("LLM_MODEL", "gpt-4o-mini"),
+    # OpenAI-compatible API base, e.g. http://localhost:8001/v1 for mock_llm.py.
+    "llm_base_url": os.getenv("LLM_BASE_URL", "https://aiproxy.sanand.workers.dev/openai/v1"),
+    # Every /run call gets its own scratch directory under this root, so
+    # concurrent tasks never overwrite each other's generated scripts.
+    "workspace_root": os.getenv("WORKSPACE_ROOT", os.path.join(tempfile.gettempdir(), "task-runner")),
+    "keep_workspaces": os.getenv("KEEP_WORKSPACES", "").lower() in ("1", "true", "yes"),
+    # Number of generated scripts allowed to execute at the same time.
+    "max_concurrent_tasks": int(os.getenv("MAX_CONCURRENT_TASKS", str(os.cpu_count() or 1))),
+    # Plans (code + dependencies) that executed successfully, reused for identical tasks.
+    "plan_cache_path": os.getenv("PLAN_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "task-runner", "plans.json")),
+    "plan_cache_size": int(os.getenv("PLAN_CACHE_SIZE", "256")),
+    # Virtualenvs built once per dependency set and reused across tasks.
+    "env_root": os.getenv("ENV_CACHE_ROOT", os.path.join(os.path.expanduser("~"), ".cache", "task-runner", "envs")),
+    "env_python": os.getenv("ENV_PYTHON"),
+    "env_cache_max_envs": int(os.getenv("ENV_CACHE_MAX_ENVS", "32")),
+    "env_cache_max_bytes": int(os.getenv("ENV_CACHE_MAX_BYTES", str(5 * 1024 ** 3))),
+    # Dependency sets built in the background at startup, as a JSON list of lists.
+    "prewarm_dependency_sets": json.loads(os.getenv(
+        "PREWARM_DEPENDENCY_SETS",
+        '[[], ["numpy"], ["pillow"], ["python-dateutil"], ["pandas", "numpy"]]',
+    )),
+    # Long-lived workers per environment that preload common modules and fork
+    # a fresh child for every script instead of starting a new interpreter.
+    # WARM_WORKERS_PER_ENV are started ahead of time; pools grow on demand up
+    # to max_concurrent_tasks so they never limit concurrency.
+    "warm_workers": os.getenv("WARM_WORKERS", "true").lower() in ("1", "true", "yes"),
+    "warm_workers_per_env": int(os.getenv("WARM_WORKERS_PER_ENV", "2")),
+    "warm_worker_envs": int(os.getenv("WARM_WORKER_ENVS", "4")),
+    "warm_worker_preload": os.getenv(
+        "WARM_WORKER_PRELOAD", "json,sqlite3,datetime,dateutil.parser,PIL.Image,numpy,requests"
+    ).split(","),
+    # Background job mode (POST /jobs): worker count, queue bound and how many
+    # finished jobs are kept around for status polling.
+    "job_workers": int(os.getenv("JOB_WORKERS", "4")),
+    "job_queue_size": int(os.getenv("JOB_QUEUE_SIZE", "1000")),
+    "job_history": int(os.getenv("JOB_HISTORY", "1000")),
+    # What a failed attempt sends back to the LLM: the exception plus at most
+    # this many frames, capped in characters. A script is killed this many
+    # seconds after it printed a complete traceback.
+    "repair_max_frames": int(os.getenv("REPAIR_MAX_FRAMES", "8")),
+    "repair_max_error_chars": int(os.getenv("REPAIR_MAX_ERROR_CHARS", "2000")),
+    "repair_abort_grace": float(os.getenv("REPAIR_ABORT_GRACE", "0.2")),
+    # Run known task shapes with native handlers instead of the LLM.
+    "fast_paths": os.getenv("FAST_PATHS", "true").lower() in ("1", "true", "yes"),
+    # Speculative mode: race this many candidate plans (0/1 disables it) at
+    # these temperatures, as long as the expected tokens stay under the ceiling.
+    "speculative_candidates": int(os.getenv("SPECULATIVE_CANDIDATES", "0")),
+    "speculative_temperatures": [float(t) for t in os.getenv("SPECULATIVE_TEMPERATURES", "0.2,0.7,1.0").split(",")],
+    "speculative_max_tokens": int(os.getenv("SPECULATIVE_MAX_TOKENS", "20000")),
+    "speculative_token_estimate": int(os.getenv("SPECULATIVE_TOKEN_ESTIMATE", "2000")),
+    # Index of /data refreshed by mtime polling, served by /list and summarized
+    # into the planning prompt (at most this many lines; directories with more
+    # files than the dir limit are collapsed into one line).
+    "index_enabled": os.getenv("DATA_INDEX", "true").lower() in ("1", "true", "yes"),
+    "index_poll_seconds": float(os.getenv("DATA_INDEX_POLL_SECONDS", "2")),
+    "index_context_lines": int(os.getenv("DATA_INDEX_CONTEXT_LINES", "40")),
+    "index_context_dir_limit": int(os.getenv("DATA_INDEX_CONTEXT_DIR_LIMIT", "10")),
+    # Results of successful executions, replayed while the /data files they
+    # read are unchanged. Needs the data index.
+    "memo_enabled": os.getenv("RESULT_MEMO", "true").lower() in ("1", "true", "yes"),
+    "memo_root": os.getenv("RESULT_MEMO_ROOT", os.path.join(os.path.expanduser("~"), ".cache", "task-runner", "memo")),
+    "memo_size": int(os.getenv("RESULT_MEMO_SIZE", "256")),
+    # Embedding and similarity API offered to generated scripts, which reach
+    # this server at `self_url`.
+    "self_url": os.getenv("TASK_RUNNER_URL", "http://127.0.0.1:8090"),
+    "embedding_model": os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"),
+    "embedding_batch_size": int(os.getenv("EMBEDDING_BATCH_SIZE", "256")),
+    "embedding_max_concurrent_batches": int(os.getenv("EMBEDDING_MAX_CONCURRENT_BATCHES", "4")),
+    "embedding_cache_path": os.getenv("EMBEDDING_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "task-runner", "embeddings.sqlite")),
+    "similarity_block_size": int(os.getenv("SIMILARITY_BLOCK_SIZE", "2048")),
+    # Budgets of a single script execution; 0 disables a limit.
+    "exec_wall_seconds": float(os.getenv("EXEC_WALL_SECONDS", "120")),
+    "exec_cpu_seconds": int(os.getenv("EXEC_CPU_SECONDS", "60")),
+    "exec_memory_bytes": int(os.getenv("EXEC_MEMORY_MB", "4096")) * 1024 * 1024,
+    "exec_file_size_bytes": int(os.getenv("EXEC_FILE_SIZE_MB", "1024")) * 1024 * 1024,
+    "exec_output_bytes": int(os.getenv("EXEC_OUTPUT_BYTES", str(1024 * 1024))),
+    # Tasks admitted at once across /run, /run/stream and /run/batch; more are
+    # rejected with 429 instead of queueing behind the task slots.
+    "max_in_flight_tasks": int(os.getenv("MAX_IN_FLIGHT_TASKS", "32")),
+}
+
+# Shared async client for the LLM proxy, created and closed with the app.
+llm_client: httpx.AsyncClient = None
+
+# Bounds how many generated scripts run in parallel.
+task_slots = asyncio.Semaphore(config["max_concurrent_tasks"])
+
+
+class Metrics:
+    """
+    Minimal in-process counters, gauges and histograms rendered in the
+    Prometheus text format by /metrics.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+    def __init__(self):
+        self.help = {}
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    @staticmethod
+    def labels(labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = self.labels(labels)
+        series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = self.labels(labels)
+        if key not in series:
+            series[key] = {"buckets": [0] * len(self.BUCKETS), "sum": 0.0, "count": 0}
+        histogram = series[key]
+        for i, bound in enumerate(self.BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    def gauge(self, name, callback):
+        """Register a gauge whose value is read from `callback` at scrape time."""
+        self.gauges[name] = callback
+
+    @staticmethod
+    def format_labels(key, extra=()):
+        pairs = list(key) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines = []
+        for name in sorted(set(self.counters) | set(self.histograms) | set(self.gauges)):
+            kind, text = self.help.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(self.counters.get(name, {}).items()):
+                lines.append(f"{name}{self.format_labels(key)} {value}")
+            for key, histogram in sorted(self.histograms.get(name, {}).items()):
+                for bound, count in zip(self.BUCKETS, histogram["buckets"]):
+                    lines.append(f"{name}_bucket{self.format_labels(key, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{self.format_labels(key, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{name}_sum{self.format_labels(key)} {histogram['sum']}")
+                lines.append(f"{name}_count{self.format_labels(key)} {histogram['count']}")
+            if name in self.gauges:
+                lines.append(f"{name} {self.gauges[name]()}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("task_runner_http_request_seconds", "histogram", "HTTP request latency by route and status.")
+metrics.describe("task_runner_phase_seconds", "histogram", "Time spent in each phase of a task.")
+metrics.describe("task_runner_tasks_total", "counter", "Tasks completed, by how they were completed.")
+metrics.describe("task_runner_retries_total", "counter", "Repair rounds sent back to the LLM.")
+metrics.describe("task_runner_cache_total", "counter", "Cache lookups by cache and result.")
+metrics.describe("task_runner_failures_total", "counter", "Failures by type.")
+metrics.describe("task_runner_execution_failures_total", "counter", "Failed script executions by exception.")
+metrics.describe("task_runner_llm_tokens_total", "counter", "LLM tokens used, by phase and kind.")
+metrics.describe("task_runner_job_queue_depth", "gauge", "Jobs waiting in the background queue.")
+metrics.describe("task_runner_jobs_running", "gauge", "Background jobs currently running.")
+metrics.describe("task_runner_tasks_in_flight", "gauge", "Tasks admitted and not yet finished.")
+metrics.describe("task_runner_rejected_total", "counter", "Tasks rejected with 429 because too many were in flight.")
+metrics.describe("task_runner_coalesced_total", "counter", "/run requests that started an execution (leader) or joined one (follower).")
+metrics.describe("task_runner_coalesce_dedup_ratio", "gauge", "Share of /run requests served by joining an identical in-flight one.")
+metrics.describe("task_runner_coalesce_in_flight", "gauge", "Distinct /run executions in flight.")
+
+# Phase timings of the current HTTP request, reported in the Server-Timing header.
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+# Queue of (event, data) pairs for /run/stream; unset for other requests.
+progress_events = contextvars.ContextVar("progress_events", default=None)
+
+
+def emit(event, **data):
+    """Report progress of the current task to a streaming client, if any."""
+    events = progress_events.get()
+    if events is not None:
+        events.put_nowait((event, data))
+
+
+@contextmanager
+def span(phase):
+    """Time a phase of the current task into metrics and the request breakdown."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe("task_runner_phase_seconds", seconds, phase=phase)
+        timings = request_timings.get()
+        if timings is not None:
+            timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global llm_client
+    llm_client = httpx.AsyncClient(
+        headers=headers,
+        timeout=config["llm_timeout"],
+        limits=httpx.Limits(
+            max_connections=config["llm_max_connections"],
+            max_keepalive_connections=config["llm_max_keepalive_connections"],
+            keepalive_expiry=config["llm_keepalive_expiry"],
+        ),
+    )
+    prewarm = asyncio.create_task(env_pool.prewarm(config["prewarm_dependency_sets"]))
+    job_queue.start()
+    index_watch = asyncio.create_task(data_index.watch()) if config["index_enabled"] else None
+    try:
+        yield
+    finally:
+        prewarm.cancel()
+        if index_watch:
+            index_watch.cancel()
+        await job_queue.stop()
+        await worker_pool.close()
+        await llm_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    timings = {}
+    request_timings.set(timings)
+    start = time.perf_counter()
+    response = await call_next(request)
+    total = time.perf_counter() - start
+    route = request.scope.get("route")
+    metrics.observe(
+        "task_runner_http_request_seconds", total,
+        route=route.path if route else "unmatched", status=response.status_code,
+    )
+    breakdown = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in timings.items()]
+    response.headers["Server-Timing"] = ", ".join(breakdown + [f"total;dur={total * 1000:.1f}"])
+    return response
 
-app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -44,7 +339,6 @@ system_prompt = """
 - This /data folder will be located in same directory where the script is running. So write the script accordingly.
 - Design the solution using a robust, efficient, and best coding practices.
 - Also make sure that even if description ask for it data is never deleted anywhere on the file system as well as data outside /data is never accessed or exfiltrated.
-- Ensure that the pre-installed packages/modules/libraries of Python are NOT mentioned in the {python_dependencies}. For example, modules like subprocess, requests, json, os, logging, sys, math, datetime, re, etc., are pre-installed modules. They and all other pre-installed libraries must NOT be included in {python_dependencies}. Including such libraries will cause errors and instability in the application.
 - All codes should be written in such a way that it can be executed in a single go.
 - We're using Ubuntu on WSL for this task. We'll run this system on Docker where uv is already installed.
 - For handling filepaths use relevant libraries and functions as per our current system which is Ubuntu.
@@ -56,6 +350,20 @@ system_prompt = """
     - Print the output of the query.
     - Similarly, you can do for other tasks as well.
 - Make sure to include the relevant libraries and functions required for the task.
+- For text embeddings or similarity (e.g. the most similar pair of lines), do not call an embedding API or build an n×n matrix yourself. POST JSON with urllib.request to the task runner at the URL in the TASK_RUNNER_URL environment variable:
+    - /similarity/closest_pairs with {"texts": [...], "k": 1} returns {"pairs": [{"i", "j", "texts": [a, b], "score"}]}, most similar first.
+    - /similarity/top_k with {"queries": [...], "texts": [...], "k": 5} returns {"results": [[{"index", "text", "score"}, ...] per query]}.
+    - /embeddings with {"texts": [...]} returns {"embeddings": [[...], ...]} of normalized vectors.
+"""
+
+# Shorter system prompt for repair rounds: the model already gets the failing
+# script, so it only needs the rules the fix must not break.
+repair_system_prompt = """
+# You're a programming assistant fixing a Python script that failed.
+- Return the complete corrected script and its dependencies.
+- Change only what is needed to fix the error and keep the original task intact.
+- Read and write files in /data only, never delete data and never access data outside /data.
+- Keep using the similarity endpoints at TASK_RUNNER_URL if the script calls them.
 """
 
 response_format = {
@@ -89,8 +397,587 @@ response_format = {
     }
 }
 
-def resend_request(task, code, error):
-    url = "https://aiproxy.sanand.workers.dev/openai/v1/chat/completions"
+class PlanCache:
+    """
+    LRU cache of LLM-generated plans that executed successfully.
+
+    Entries are keyed on a hash of everything that shapes the LLM answer (model,
+    system prompt, response format and task text), so changing the prompt
+    naturally invalidates old plans. The cache is persisted as JSON and
+    reloaded on startup.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.load()
+
+    @staticmethod
+    def key(task):
+        payload = json.dumps([config["llm_model"], system_prompt, response_format, task], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, task):
+        key = self.key(task)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, task, python_code, python_dependencies):
+        key = self.key(task)
+        self.entries[key] = {"python_code": python_code, "python_dependencies": python_dependencies}
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.save()
+
+    def invalidate(self, task):
+        if self.entries.pop(self.key(task), None) is not None:
+            self.save()
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self.entries = OrderedDict(json.load(f))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not load plan cache {self.path}: {str(e)}")
+            return
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error(f"Could not persist plan cache {self.path}: {str(e)}")
+
+
+plan_cache = PlanCache(config["plan_cache_path"], config["plan_cache_size"])
+
+
+class EnvironmentPool:
+    """
+    Cache of ready-to-use virtualenvs keyed on the normalized dependency set.
+
+    Each environment is built once with `uv venv` + `uv pip install` and then
+    reused by every task that needs the same dependencies, so scripts run
+    straight against the cached interpreter instead of resolving packages on
+    every `uv run`. Least recently used environments are evicted when the
+    count or disk budget is exceeded; environments in use are never evicted.
+    """
+
+    def __init__(self, root, max_envs, max_bytes):
+        self.root = Path(root)
+        self.max_envs = max_envs
+        self.max_bytes = max_bytes
+        self.locks = {}
+        self.in_use = {}
+
+    @staticmethod
+    def normalize(python_dependencies):
+        """Return the sorted, de-duplicated list of requirement strings."""
+        requirements = set()
+        for d in python_dependencies or []:
+            module = d.get("module") if isinstance(d, dict) else d
+            if not module or not module.strip():
+                continue
+            match = re.match(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)(.*)$", module)
+            if not match:
+                requirements.add(module.strip())
+                continue
+            name = re.sub(r"[-_.]+", "-", match.group(1)).lower()
+            requirements.add(name + re.sub(r"\s+", "", match.group(2)))
+        return sorted(requirements)
+
+    @staticmethod
+    def key(requirements):
+        return hashlib.sha256(json.dumps(requirements).encode()).hexdigest()[:16]
+
+    def python_path(self, env_dir):
+        return env_dir / "bin" / "python"
+
+    @asynccontextmanager
+    async def environment(self, python_dependencies):
+        """
+        Yield the interpreter of an environment with the given dependencies,
+        building it first if needed, together with timing information.
+        """
+        requirements = self.normalize(python_dependencies)
+        key = self.key(requirements)
+        env_dir = self.root / key
+        start = time.perf_counter()
+        async with self.locks.setdefault(key, asyncio.Lock()):
+            cache_hit = (env_dir / ".ready").exists()
+            metrics.inc("task_runner_cache_total", cache="environment", result="hit" if cache_hit else "miss")
+            if not cache_hit:
+                with span("environment_build"):
+                    await self.build(env_dir, requirements)
+        info = {
+            "cache_hit": cache_hit,
+            "dependencies": requirements,
+            ("acquire_seconds" if cache_hit else "build_seconds"): round(time.perf_counter() - start, 3),
+        }
+        self.in_use[key] = self.in_use.get(key, 0) + 1
+        try:
+            os.utime(env_dir / ".ready")
+            yield self.python_path(env_dir), info
+        finally:
+            self.in_use[key] -= 1
+        if not cache_hit:
+            await self.evict()
+
+    async def build(self, env_dir, requirements):
+        logging.info(f"Building environment {env_dir.name} for {requirements}")
+        shutil.rmtree(env_dir, ignore_errors=True)
+        env_dir.parent.mkdir(parents=True, exist_ok=True)
+        commands = [["uv", "venv", "--quiet", str(env_dir)] + (["--python", config["env_python"]] if config["env_python"] else [])]
+        if requirements:
+            commands.append(["uv", "pip", "install", "--quiet", "--python", str(self.python_path(env_dir))] + requirements)
+        for command in commands:
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            _, stderr = await process.communicate()
+            if process.returncode != 0:
+                shutil.rmtree(env_dir, ignore_errors=True)
+                raise RuntimeError(f"Failed to install dependencies {requirements}: {stderr.decode(errors='replace').strip()}")
+        size = await asyncio.to_thread(self.disk_usage, env_dir)
+        with open(env_dir / ".ready", "w") as f:
+            json.dump({"dependencies": requirements, "bytes": size}, f)
+
+    @staticmethod
+    def disk_usage(path):
+        total = 0
+        for dirpath, _, filenames in os.walk(path):
+            for name in filenames:
+                try:
+                    total += os.lstat(os.path.join(dirpath, name)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def ready_envs(self):
+        """(last used, directory, bytes) of every built environment, oldest first."""
+        envs = []
+        for marker in self.root.glob("*/.ready"):
+            try:
+                with open(marker) as f:
+                    size = json.load(f).get("bytes", 0)
+                envs.append((marker.stat().st_mtime, marker.parent, size))
+            except (OSError, ValueError):
+                continue
+        return sorted(envs)
+
+    async def evict(self):
+        """
+        Remove least recently used environments and their warm workers.
+
+        Each victim is checked and removed while holding its key lock, so a
+        task cannot pick it up in between; one used since the scan is kept.
+        """
+        envs = await asyncio.to_thread(self.ready_envs)
+        total = sum(size for _, _, size in envs)
+        count = len(envs)
+        for last_used, env_dir, size in envs:
+            if count <= self.max_envs and total <= self.max_bytes:
+                break
+            async with self.locks.setdefault(env_dir.name, asyncio.Lock()):
+                try:
+                    unchanged = (env_dir / ".ready").stat().st_mtime == last_used
+                except OSError:
+                    unchanged = False
+                if self.in_use.get(env_dir.name) or not unchanged:
+                    continue
+                logging.info(f"Evicting environment {env_dir.name}")
+                await asyncio.to_thread(shutil.rmtree, env_dir, ignore_errors=True)
+            await worker_pool.discard(self.python_path(env_dir))
+            count -= 1
+            total -= size
+
+    async def prewarm(self, dependency_sets):
+        for dependencies in dependency_sets:
+            try:
+                async with self.environment(dependencies) as (python, info):
+                    if config["warm_workers"]:
+                        await worker_pool.prewarm(python)
+                    logging.info(f"Prewarmed environment {info}")
+            except Exception as e:
+                logging.error(f"Could not prewarm environment {dependencies}: {str(e)}")
+
+
+env_pool = EnvironmentPool(config["env_root"], config["env_cache_max_envs"], config["env_cache_max_bytes"])
+
+
+# Installed in the process that runs a generated script: an audit hook that
+# records which files under the data roots the script opened or listed,
+# whether it started other processes and whether it connected anywhere other
+# than the task runner itself (TASK_RUNNER_URL), written as JSON when the
+# script exits.
+AUDIT_SOURCE = r"""
+def record_data_access(audit_path, roots):
+    import atexit, json, os, sys
+    from urllib.parse import urlsplit
+
+    prefixes = tuple(root.rstrip("/") + "/" for root in roots)
+    opened, listed, state = set(), set(), {"spawned": False, "network": False}
+    runner = urlsplit(os.environ.get("TASK_RUNNER_URL", ""))
+
+    def under_roots(path):
+        if isinstance(path, int):
+            return None
+        try:
+            path = os.path.abspath(os.fsdecode(path))
+        except (TypeError, ValueError):
+            return None
+        if path in roots or path.startswith(prefixes):
+            return os.path.realpath(path)
+        return None
+
+    def is_runner(address):
+        if not isinstance(address, tuple) or len(address) < 2 or not runner.hostname or address[1] != runner.port:
+            return False
+        if "runner_hosts" not in state:
+            import socket
+
+            try:
+                state["runner_hosts"] = {runner.hostname} | {info[4][0] for info in socket.getaddrinfo(runner.hostname, runner.port)}
+            except OSError:
+                state["runner_hosts"] = {runner.hostname}
+        return address[0] in state["runner_hosts"]
+
+    def hook(event, args):
+        if event in ("open", "sqlite3.connect") and args:
+            path = under_roots(args[0])
+            if path:
+                opened.add(path)
+        elif event in ("os.listdir", "os.scandir"):
+            path = under_roots(args[0] if args and args[0] is not None else ".")
+            if path:
+                listed.add(path)
+        elif event.startswith(("subprocess.", "os.system", "os.exec", "os.posix_spawn", "os.spawn", "os.fork")):
+            state["spawned"] = True
+        elif event == "socket.connect" and len(args) > 1 and not state["network"]:
+            state["network"] = not is_runner(args[1])
+
+    def dump():
+        with open(audit_path, "w") as f:
+            json.dump({"opened": sorted(opened), "listed": sorted(listed), "spawned": state["spawned"], "network": state["network"]}, f)
+
+    atexit.register(dump)
+    sys.addaudithook(hook)
+"""
+
+# Lowers resource limits of the process that runs a generated script. Exceeding
+# the CPU or file size limit kills it with SIGXCPU / SIGXFSZ; exceeding the
+# address space limit raises MemoryError inside the script.
+LIMITS_SOURCE = r"""
+def apply_limits(limits):
+    import resource
+
+    for name, value in limits.items():
+        if not value:
+            continue
+        which = getattr(resource, name)
+        _, hard = resource.getrlimit(which)
+        soft = value if hard == resource.RLIM_INFINITY else min(value, hard)
+        # Two extra CPU seconds so SIGXCPU, not SIGKILL, reports the overrun.
+        ceiling = soft + 2 if name == "RLIMIT_CPU" else soft
+        resource.setrlimit(which, (soft, ceiling if hard == resource.RLIM_INFINITY else min(ceiling, hard)))
+"""
+
+# Runs a generated script in a fresh interpreter, with the audit hook when an
+# audit path is given:
+# python -c SCRIPT_RUNNER_SOURCE script audit_path roots limits
+SCRIPT_RUNNER_SOURCE = AUDIT_SOURCE + LIMITS_SOURCE + r"""
+import json, os, runpy, sys
+
+script, audit_path, roots = sys.argv[1], sys.argv[2], json.loads(sys.argv[3])
+apply_limits(json.loads(sys.argv[4]))
+if audit_path:
+    record_data_access(audit_path, roots)
+sys.argv = [script]
+sys.path[0] = os.path.dirname(script)
+runpy.run_path(script, run_name="__main__")
+"""
+
+# Source of the warm worker process. It imports the preload modules once, then
+# reads one JSON job per line from stdin and runs each script in a forked child
+# with its own cwd, environment, stdio files and a fresh __main__ namespace.
+# For every job it answers with {"pid": ...} followed by {"returncode": ...}.
+# Each child leads its own process group so that killing the group also stops
+# any processes the script started; leftovers are killed once the child exits.
+WORKER_SOURCE = AUDIT_SOURCE + LIMITS_SOURCE + r"""
+import importlib, json, os, runpy, sys, traceback
+
+for name in sys.argv[1:]:
+    try:
+        importlib.import_module(name)
+    except Exception:
+        pass
+
+channel = os.fdopen(os.dup(1), "w")
+devnull = os.open(os.devnull, os.O_RDONLY)
+os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+
+
+def run(job):
+    os.chdir(job["cwd"])
+    os.environ.clear()
+    os.environ.update(job["env"])
+    if "tempfile" in sys.modules:
+        sys.modules["tempfile"].tempdir = None
+    os.dup2(devnull, 0)
+    os.dup2(os.open(job["stdout"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644), 1)
+    os.dup2(os.open(job["stderr"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644), 2)
+    if job["env"].get("PYTHONUNBUFFERED"):
+        sys.stdout.reconfigure(line_buffering=True)
+    apply_limits(job["limits"])
+    if job.get("audit"):
+        record_data_access(job["audit"], job["roots"])
+    sys.argv = [job["script"]]
+    sys.path[0] = os.path.dirname(job["script"])
+    try:
+        runpy.run_path(job["script"], run_name="__main__")
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+for line in sys.stdin:
+    job = json.loads(line)
+    pid = os.fork()
+    if pid == 0:
+        os.setpgid(0, 0)
+        channel.close()
+        # Exit through normal interpreter shutdown so atexit handlers run and
+        # files the script left open are flushed.
+        sys.exit(run(job))
+    try:
+        # Also set from the parent, so the group exists before its pid is sent.
+        os.setpgid(pid, pid)
+    except OSError:
+        pass
+    channel.write(json.dumps({"pid": pid}) + "\n")
+    channel.flush()
+    _, status = os.waitpid(pid, 0)
+    try:
+        os.killpg(pid, 9)
+    except OSError:
+        pass
+    channel.write(json.dumps({"returncode": os.waitstatus_to_exitcode(status)}) + "\n")
+    channel.flush()
+"""
+
+
+class WorkerPool:
+    """
+    Pool of warm worker processes per environment interpreter.
+
+    Workers import the heavy, commonly used modules once; each script then runs
+    in a child forked from a worker, which keeps the isolation of a separate
+    process while skipping interpreter start-up and those imports. Pools are
+    kept for the most recently used environments only.
+
+    A script never waits for a worker: when all of them are busy another one
+    is started, and up to `max_workers_per_env` are kept for reuse.
+    """
+
+    def __init__(self, workers_per_env, max_envs, preload, max_workers_per_env):
+        self.workers_per_env = workers_per_env
+        self.max_workers_per_env = max(workers_per_env, max_workers_per_env)
+        self.max_envs = max_envs
+        self.preload = [name.strip() for name in preload if name.strip()]
+        self.pools = OrderedDict()
+
+    def pool(self, python):
+        key = str(python)
+        if key not in self.pools:
+            self.pools[key] = {"idle": asyncio.Queue(), "workers": set()}
+        self.pools.move_to_end(key)
+        return self.pools[key]
+
+    async def spawn(self, python):
+        return await asyncio.create_subprocess_exec(
+            str(python), "-c", WORKER_SOURCE, *self.preload,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+        )
+
+    async def acquire(self, python):
+        pool = self.pool(python)
+        while not pool["idle"].empty():
+            worker = pool["idle"].get_nowait()
+            if worker.returncode is None:
+                return worker
+            pool["workers"].discard(worker)
+        worker = await self.spawn(python)
+        # If the pool was discarded meanwhile, release() stops the worker.
+        pool["workers"].add(worker)
+        return worker
+
+    def release(self, python, worker):
+        pool = self.pools.get(str(python))
+        if pool is None or worker not in pool["workers"]:
+            self.stop(worker)
+        elif worker.returncode is not None:
+            pool["workers"].discard(worker)
+        elif len(pool["workers"]) > self.max_workers_per_env:
+            self.retire(python, worker)
+        else:
+            pool["idle"].put_nowait(worker)
+
+    async def run(self, python, script_path, workspace, env, on_stderr=None, audit=None, on_stdout=None, timeout=None):
+        """
+        Run a script in a child forked from a warm worker.
+
+        stderr is tailed while the child runs; once `on_stderr` returns True
+        for a line the child is killed after `repair_abort_grace` seconds.
+        With `audit`, the child records its /data accesses to that file.
+        With `on_stdout`, stdout is tailed too and passed on line by line.
+        A child still running `timeout` seconds after it was forked is
+        killed and TimeoutError raised; waiting for a worker does not count.
+        """
+        worker = await self.acquire(python)
+        job = {
+            "script": str(script_path),
+            "cwd": os.getcwd(),
+            "env": env,
+            "stdout": str(workspace / "stdout.txt"),
+            "stderr": str(workspace / "stderr.txt"),
+            "audit": str(audit) if audit else None,
+            "roots": data_roots(),
+            "limits": execution_limits(),
+        }
+        for name in ("stdout", "stderr"):
+            open(job[name], "w").close()
+        stderr_lines = CappedOutput()
+        killer = deadline = None
+        pid = None
+        try:
+            worker.stdin.write((json.dumps(job) + "\n").encode())
+            await worker.stdin.drain()
+            pid = json.loads(await worker.stdout.readline())["pid"]
+            deadline = Deadline(pid, timeout)
+            done = asyncio.ensure_future(worker.stdout.readline())
+            with open(job["stderr"], "r", errors="replace") as f, open(job["stdout"], "r", errors="replace") as out:
+                pending = pending_out = ""
+                while True:
+                    finished = done.done()
+                    *lines, pending = (pending + f.read()).split("\n")
+                    if finished and pending:
+                        lines.append(pending)
+                    for line in lines:
+                        stderr_lines.append(line)
+                        if on_stderr is not None and on_stderr(line) and killer is None:
+                            killer = asyncio.get_running_loop().call_later(config["repair_abort_grace"], kill_quietly, pid)
+                    if on_stdout is not None:
+                        *lines, pending_out = (pending_out + out.read()).split("\n")
+                        if finished and pending_out:
+                            lines.append(pending_out)
+                        for line in lines:
+                            on_stdout(line)
+                    if finished:
+                        break
+                    await asyncio.wait([done], timeout=0.05)
+            returncode = json.loads(await done)["returncode"]
+        except (OSError, ValueError, KeyError) as e:
+            self.retire(python, worker)
+            raise RuntimeError(f"Warm worker failed: {str(e)}")
+        except BaseException:
+            # e.g. cancelled: the worker is mid-job, so it cannot be reused.
+            if pid is not None:
+                kill_quietly(pid)
+            self.retire(python, worker)
+            raise
+        else:
+            self.release(python, worker)
+        finally:
+            if killer is not None:
+                killer.cancel()
+            if deadline is not None:
+                deadline.cancel()
+        stdout = CappedOutput()
+        with open(job["stdout"], "r", errors="replace") as f:
+            for line in f:
+                stdout.append(line.rstrip("\n"))
+        await self.trim()
+        if deadline.expired:
+            raise asyncio.TimeoutError()
+        return returncode, stdout.text(), stderr_lines.text()
+
+    def retire(self, python, worker):
+        pool = self.pools.get(str(python))
+        if pool is not None:
+            pool["workers"].discard(worker)
+        self.stop(worker)
+
+    async def prewarm(self, python):
+        pool = self.pool(python)
+        while len(pool["workers"]) < self.workers_per_env:
+            worker = await self.spawn(python)
+            pool["workers"].add(worker)
+            pool["idle"].put_nowait(worker)
+        await self.trim()
+
+    async def trim(self):
+        while len(self.pools) > self.max_envs:
+            python, _ = next(iter(self.pools.items()))
+            await self.discard(python)
+
+    async def discard(self, python):
+        """Stop the idle workers of an environment; busy ones stop on release."""
+        pool = self.pools.pop(str(python), None)
+        if pool is None:
+            return
+        idle = []
+        while not pool["idle"].empty():
+            idle.append(pool["idle"].get_nowait())
+        await self.join(idle)
+
+    async def close(self):
+        workers = [worker for pool in self.pools.values() for worker in pool["workers"]]
+        self.pools.clear()
+        await self.join(workers)
+
+    async def join(self, workers):
+        """Stop workers and wait for them to exit, so none outlive the event loop."""
+        for worker in workers:
+            self.stop(worker)
+        await asyncio.gather(*(worker.wait() for worker in workers))
+
+    @staticmethod
+    def stop(worker):
+        if worker.returncode is None:
+            try:
+                # Kill first: on stdin EOF the worker exits by itself and
+                # kill() could then reap it before the event loop does.
+                worker.kill()
+                worker.stdin.close()
+            except ProcessLookupError:
+                pass
+
+
+worker_pool = WorkerPool(config["warm_workers_per_env"], config["warm_worker_envs"], config["warm_worker_preload"], config["max_concurrent_tasks"])
+
+
+async def resend_request(task, code, error):
+    url = f"{config['llm_base_url'].rstrip('/')}/chat/completions"
     updated_task = f'''
 Update this python code:
 {code}
@@ -102,11 +989,11 @@ Error encountered while running the task:
 {error}
 '''
     data = {
-        "model": "gpt-4o-mini",
+        "model": config["llm_model"],
         "messages": [
             {
                 "role": "system",
-                "content": system_prompt
+                "content": repair_system_prompt
             },
             {
                 "role": "user",
@@ -115,144 +1002,2103 @@ Error encountered while running the task:
         "response_format": response_format
     }
     try:
-        response = requests.post(url=url, headers=headers, json=data)
-        response.raise_for_status()
+        with span("llm_repair"):
+            response = await llm_client.post(url=url, json=data)
+            response.raise_for_status()
         return response
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         logging.error(f"Request failed: {str(e)}")
+        metrics.inc("task_runner_failures_total", type="llm_error")
         raise HTTPException(status_code=500, detail="Error communicating with LLM")
 
 
-def code_executer(python_dependencies,python_code):
-    inline_metadata_script = f"""
-# /// script
-# requires-python = ">=3.11"
-# dependencies = [
-{''.join(f"# \"{d.get('module')}\",\n" for d in python_dependencies)}# ]
-# ///
-""" 
-    with open ("task.py", "w") as f:
-        f.write(inline_metadata_script)
+@asynccontextmanager
+async def task_workspace():
+    """
+    Create an isolated scratch directory for a single task.
+
+    The directory holds the generated script and is removed once the task
+    finishes, unless `keep_workspaces` is set for debugging.
+    """
+    os.makedirs(config["workspace_root"], exist_ok=True)
+    workspace = Path(tempfile.mkdtemp(prefix="task-", dir=config["workspace_root"]))
+    try:
+        yield workspace
+    finally:
+        if not config["keep_workspaces"]:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+
+def kill_quietly(pid):
+    """Kill the process group led by `pid`: the script and anything it started."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+class Deadline:
+    """Kills the process group of `pid` after `seconds` (if set); `expired` tells whether it did."""
+
+    def __init__(self, pid, seconds):
+        self.expired = False
+        self.handle = asyncio.get_running_loop().call_later(seconds, self.expire, pid) if seconds else None
+
+    def expire(self, pid):
+        self.expired = True
+        kill_quietly(pid)
+
+    def cancel(self):
+        if self.handle is not None:
+            self.handle.cancel()
+
+
+def execution_limits():
+    """Resource limits for a script process, by `resource` constant name."""
+    return {
+        "RLIMIT_CPU": config["exec_cpu_seconds"],
+        "RLIMIT_AS": config["exec_memory_bytes"],
+        "RLIMIT_FSIZE": config["exec_file_size_bytes"],
+    }
+
+
+class CappedOutput:
+    """
+    Collects lines of script output up to `exec_output_bytes`, keeping the
+    first and last half of the budget and dropping the middle, so a chatty
+    script cannot exhaust memory while its final traceback is still kept.
+    """
+
+    def __init__(self, limit=None):
+        self.half = (limit or config["exec_output_bytes"]) // 2
+        self.head, self.tail = [], deque()
+        self.head_bytes = self.tail_bytes = self.dropped = 0
+
+    def append(self, line):
+        line = line[:self.half]
+        size = len(line) + 1
+        if self.head_bytes + size <= self.half and not self.tail:
+            self.head.append(line)
+            self.head_bytes += size
+            return
+        self.tail.append(line)
+        self.tail_bytes += size
+        while self.tail_bytes > self.half and len(self.tail) > 1:
+            dropped = self.tail.popleft()
+            self.tail_bytes -= len(dropped) + 1
+            self.dropped += len(dropped) + 1
+
+    def text(self):
+        lines = self.head + ([f"[... {self.dropped} bytes of output omitted ...]"] if self.dropped else []) + list(self.tail)
+        return "\n".join(lines)
+
+
+def data_roots():
+    """The data root as configured and resolved, for matching accessed paths."""
+    return sorted({str(Path(config["root"])), str(Path(config["root"]).resolve())})
+
+
+async def run_subprocess(python, script_path, env, on_stderr=None, audit=None, on_stdout=None, timeout=None):
+    """
+    Run a script in a fresh interpreter, reading stderr line by line.
+
+    Once `on_stderr` returns True for a line the process is killed after
+    `repair_abort_grace` seconds instead of waiting for it to finish. With
+    `audit`, the script's /data accesses are recorded to that file. With
+    `on_stdout`, stdout lines are passed on as they are printed.
+
+    The script runs in its own session and process group, which is killed
+    once it exits or is cancelled, so processes it left behind neither
+    survive nor hold its output pipes open. A script still running after
+    `timeout` seconds is killed and TimeoutError raised.
+    """
+    process = await asyncio.create_subprocess_exec(
+        str(python), "-c", SCRIPT_RUNNER_SOURCE, str(script_path), str(audit or ""), json.dumps(data_roots()), json.dumps(execution_limits()),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=env,
+        start_new_session=True,
+    )
+    stdout = asyncio.create_task(read_stdout(process.stdout, on_stdout))
+    stderr_lines = CappedOutput()
+    killer = None
+
+    async def read_stderr():
+        nonlocal killer
+        async for line in iter_lines(process.stderr):
+            stderr_lines.append(line)
+            if on_stderr is not None and on_stderr(line) and killer is None:
+                killer = asyncio.get_running_loop().call_later(config["repair_abort_grace"], kill_quietly, process.pid)
+
+    stderr = asyncio.create_task(read_stderr())
+    deadline = Deadline(process.pid, timeout)
+    try:
+        try:
+            # process.wait() also waits for the pipes to close, which a
+            # leftover child of the script could hold open indefinitely.
+            while process.returncode is None:
+                await asyncio.sleep(0.05)
+        finally:
+            kill_quietly(process.pid)
+        await stderr
+    finally:
+        deadline.cancel()
+        if killer is not None:
+            killer.cancel()
+    std_out = await stdout
+    if deadline.expired:
+        raise asyncio.TimeoutError()
+    return process.returncode, std_out, stderr_lines.text()
+
+
+async def iter_lines(stream, max_line=None):
+    """
+    Decoded lines of a process stream. Unlike iterating the StreamReader this
+    does not fail on very long lines; they are split every `max_line` chars.
+    """
+    max_line = max_line or config["exec_output_bytes"]
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    pending = ""
+    while True:
+        chunk = await stream.read(65536)
+        *lines, pending = (pending + decoder.decode(chunk, final=not chunk)).split("\n")
+        for line in lines:
+            yield line
+        if not chunk:
+            break
+        while len(pending) > max_line:
+            yield pending[:max_line]
+            pending = pending[max_line:]
+    if pending:
+        yield pending
+
+
+async def read_stdout(stream, on_stdout=None):
+    output = CappedOutput()
+    async for line in iter_lines(stream):
+        output.append(line)
+        if on_stdout is not None:
+            on_stdout(line)
+    return output.text()
+
+
+class TracebackWatcher:
+    """Flags a stream of stderr lines as failed once a full traceback was printed."""
+
+    def __init__(self):
+        self.in_traceback = False
+        self.failed = False
+
+    def __call__(self, line):
+        if line.startswith("Traceback (most recent call last):"):
+            self.in_traceback = True
+        elif self.in_traceback and line.strip() and not line[0].isspace():
+            # The unindented line after the frames is the exception itself.
+            self.in_traceback = False
+            self.failed = True
+        return self.failed
+
+
+FRAME_PATTERN = re.compile(r'^\s*File "(.+)", line (\d+)(?:, in (.+))?$')
+
+
+def compact_error(text, max_chars=None):
+    """Collapse repeated lines and cap the text, keeping its head and tail."""
+    max_chars = max_chars or config["repair_max_error_chars"]
+    lines, previous, repeats = [], None, 0
+    for line in text.split("\n") + [None]:
+        if line == previous:
+            repeats += 1
+            continue
+        if repeats:
+            lines.append(f"[previous line repeated {repeats} more times]")
+        if line is not None:
+            lines.append(line)
+        previous, repeats = line, 0
+    text = "\n".join(lines).strip()
+    if len(text) > max_chars:
+        head = max_chars // 3
+        tail = max_chars - head
+        text = f"{text[:head]}\n... [{len(text) - max_chars} characters truncated] ...\n{text[-tail:]}"
+    return text
+
+
+def summarize_traceback(stderr_lines, script_path):
+    """
+    Reduce the stderr of a failed script to the exception and the frames of
+    the generated script, which is all the model needs to repair it.
+    """
+    start = None
+    for i, line in enumerate(stderr_lines):
+        if line.startswith("Traceback (most recent call last):"):
+            start = i
+        elif start is None and line.lstrip().startswith("File"):
+            start = i
+    if start is None:
+        return compact_error("\n".join(stderr_lines))
+
+    frames, exception = [], []
+    for line in stderr_lines[start:]:
+        match = FRAME_PATTERN.match(line)
+        if match:
+            filename, lineno, function = match.groups()
+            frames.append({"file": filename, "line": lineno, "function": function, "source": ""})
+        elif not line.strip() or line.startswith("Traceback"):
+            continue
+        elif line[0].isspace():
+            if frames and not frames[-1]["source"] and line.strip().strip("^~ "):
+                frames[-1]["source"] = line.strip()
+        else:
+            exception.append(line)
+
+    script_frames = [f for f in frames if f["file"] == str(script_path)]
+    if frames and frames[-1] not in script_frames:
+        # Also keep the innermost frame, e.g. the library call that raised.
+        script_frames.append(frames[-1])
+    summary, previous, repeats = [], None, 0
+    for frame in script_frames[-config["repair_max_frames"]:]:
+        location = "task.py" if frame["file"] == str(script_path) else frame["file"]
+        entry = f"  {location} line {frame['line']}" + (f", in {frame['function']}" if frame["function"] else "")
+        if frame["source"]:
+            entry += f": {frame['source']}"
+        if entry == previous:
+            repeats += 1
+            continue
+        if repeats:
+            summary.append(f"  [previous frame repeated {repeats} more times]")
+        summary.append(entry)
+        previous, repeats = entry, 0
+    if repeats:
+        summary.append(f"  [previous frame repeated {repeats} more times]")
+    text = "\n".join(exception[-3:] or ["Script failed"])
+    if summary:
+        text += "\nTraceback (most recent call last):\n" + "\n".join(summary)
+    return compact_error(text)
+
+
+# Import names whose PyPI distribution is published under a different name.
+IMPORT_TO_DISTRIBUTION = {
+    "PIL": "pillow",
+    "attr": "attrs",
+    "bs4": "beautifulsoup4",
+    "cv2": "opencv-python-headless",
+    "Crypto": "pycryptodome",
+    "dateutil": "python-dateutil",
+    "docx": "python-docx",
+    "dotenv": "python-dotenv",
+    "fitz": "pymupdf",
+    "git": "gitpython",
+    "jwt": "pyjwt",
+    "magic": "python-magic",
+    "pkg_resources": "setuptools",
+    "pptx": "python-pptx",
+    "serial": "pyserial",
+    "skimage": "scikit-image",
+    "sklearn": "scikit-learn",
+    "yaml": "pyyaml",
+}
+
+# Namespace packages shared by many distributions (google-cloud-storage,
+# azure-identity, ...): only the model's dependency list can say which one.
+NAMESPACE_IMPORTS = {"azure", "google", "mpl_toolkits"}
+
+
+class PreflightError(Exception):
+    pass
+
+
+def bound_names(tree):
+    """Every name the module binds anywhere: assignments, imports, defs, arguments."""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update((alias.asname or alias.name).split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            names.add(node.name)
+    return names
+
+
+def optional_imports(tree):
+    """Top-level names imported inside `try` blocks that handle a failed import."""
+    names = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Try):
+            continue
+        handles_import = False
+        for handler in node.handlers:
+            caught = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+            if any(
+                exception is None
+                or (isinstance(exception, ast.Name) and exception.id in ("ImportError", "ModuleNotFoundError", "Exception", "BaseException"))
+                for exception in caught
+            ):
+                handles_import = True
+        if not handles_import:
+            continue
+        for statement in node.body:
+            for child in ast.walk(statement):
+                if isinstance(child, ast.Import):
+                    names.update(alias.name.split(".")[0] for alias in child.names)
+                elif isinstance(child, ast.ImportFrom) and child.module and not child.level:
+                    names.add(child.module.split(".")[0])
+    return names
+
+
+def preflight(python_code, python_dependencies):
+    """
+    Check generated code locally before paying for an execution.
+
+    Parses the code, rejects syntax errors and standard-library modules used
+    without being imported, and rebuilds the dependency list: standard-library
+    modules the model listed are dropped and third-party imports it forgot are
+    added under their distribution names. Imports guarded by `except
+    ImportError` are optional and never added, nor are imports without a
+    known distribution that a differently named listed package may provide. Returns the corrected dependencies or raises PreflightError.
+    """
+    if not python_code or not python_code.strip():
+        raise PreflightError("SyntaxError: the generated script is empty")
+    try:
+        tree = ast.parse(python_code, filename="task.py")
+    except SyntaxError as e:
+        line = (e.text or "").strip()
+        raise PreflightError(f"SyntaxError: {e.msg}\n  task.py line {e.lineno}: {line}")
+
+    stdlib = sys.stdlib_module_names
+    bound = bound_names(tree)
+    # A star import may bind anything, so only check names without one.
+    star_import = any(isinstance(node, ast.ImportFrom) and node.names[0].name == "*" for node in ast.walk(tree))
+    for node in ast.walk(tree):
+        if (
+            not star_import
+            and isinstance(node, ast.Name)
+            and isinstance(node.ctx, ast.Load)
+            and node.id in stdlib
+            and node.id not in bound
+            and not hasattr(builtins, node.id)
+        ):
+            raise PreflightError(
+                f"NameError: name '{node.id}' is not defined (missing `import {node.id}`)\n  task.py line {node.lineno}"
+            )
+
+    imports = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            imports.add(node.module.split(".")[0])
+
+    def normalize(name):
+        return re.sub(r"[-_.]+", "-", name).lower()
+
+    dependencies, seen = [], set()
+    for d in python_dependencies or []:
+        module = (d.get("module") if isinstance(d, dict) else d) or ""
+        match = re.match(r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)(.*)$", module)
+        if not match or match.group(1) in stdlib:
+            continue
+        name = IMPORT_TO_DISTRIBUTION.get(match.group(1), match.group(1))
+        dependencies.append({"module": name + match.group(2).strip()})
+        seen.add(normalize(name))
+    required = imports - stdlib - optional_imports(tree)
+    # Listed packages no import accounts for by name, e.g. google-cloud-storage
+    # for `from google.cloud import storage`.
+    unclaimed = seen - {normalize(IMPORT_TO_DISTRIBUTION.get(name, name)) for name in imports}
+    for name in sorted(required):
+        distribution = IMPORT_TO_DISTRIBUTION.get(name, name)
+        if normalize(distribution) in seen:
+            continue
+        if name not in IMPORT_TO_DISTRIBUTION and (name in NAMESPACE_IMPORTS or any(normalize(name) in listed for listed in unclaimed)):
+            continue
+        dependencies.append({"module": distribution})
+        seen.add(normalize(distribution))
+    return dependencies
+
+
+def limit_error(signum):
+    """Error message for a script killed by a signal, naming the budget it exceeded."""
+    if signum == signal.SIGXCPU:
+        return f"CPUTimeLimitExceeded: the script used more than {config['exec_cpu_seconds']} CPU seconds"
+    if signum == signal.SIGXFSZ:
+        return f"FileSizeLimitExceeded: the script wrote a file larger than {config['exec_file_size_bytes'] // (1024 * 1024)} MB"
+    try:
+        name = signal.Signals(signum).name
+    except ValueError:
+        name = f"signal {signum}"
+    return f"Killed: the script was terminated by {name}"
+
+
+async def code_executer(python_dependencies,python_code,workspace,report=None,task=None):
+    """
+    Run the generated code in the cached environment for its dependencies.
+
+    The code is pre-flighted first, so broken scripts are rejected without
+    starting a process and the dependency list is derived from the imports.
+    stderr is watched while the script runs so a script that printed a
+    traceback is stopped right away. Failures are returned as a compact
+    traceback summary. Environment and execution timings are written to
+    `report` when given. When `task` is given, a successful run is memoized
+    against the /data files it read.
+    """
+    script_path = workspace / "task.py"
+    with open (script_path, "w") as f:
         f.write(python_code)    
     
     try:
-        output = subprocess.run(["uv","run","task.py"], capture_output=True, text=True)
-        std_err = output.stderr.split("\n")
+        with span("preflight"):
+            python_dependencies = preflight(python_code, python_dependencies)
+    except PreflightError as e:
+        error = str(e)
+        metrics.inc("task_runner_execution_failures_total", exception=error.split(":")[0])
+        return {"error": error}
 
-        std_out = output.stdout
-        exit_code = output.returncode
+    memo_token = None
+    try:
+        async with env_pool.environment(python_dependencies) as (python, env_info):
+            emit("environment", **env_info)
+            with span("queue"):
+                await task_slots.acquire()
+            try:
+                audit = None
+                if task is not None and result_memo.enabled():
+                    # Begin before the snapshot and end only once record()
+                    # has taken its own, so no other write to /data can slip
+                    # in unnoticed on either side.
+                    memo_token = result_memo.begin()
+                    with span("memo_snapshot"):
+                        before = await asyncio.to_thread(data_index.snapshot)
+                    audit = workspace / "access.json"
+                start = time.perf_counter()
+                env = {**os.environ, "TMPDIR": str(workspace), "TASK_RUNNER_URL": config["self_url"]}
+                watcher = TracebackWatcher()
+                on_stderr, on_stdout = watcher, None
+                if progress_events.get() is not None:
+                    # Stream output live, which needs the script to flush per line.
+                    env["PYTHONUNBUFFERED"] = "1"
+                    on_stdout = lambda line: emit("stdout", line=line)
+                    on_stderr = lambda line: emit("stderr", line=line) or watcher(line)
+                emit("execute")
+                with span("execute"):
+                    wall_seconds = config["exec_wall_seconds"]
+                    try:
+                        if config["warm_workers"]:
+                            exit_code, std_out, stderr = await worker_pool.run(python, script_path, workspace, env, on_stderr, audit, on_stdout, wall_seconds)
+                        else:
+                            exit_code, std_out, stderr = await run_subprocess(python, script_path, env, on_stderr, audit, on_stdout, wall_seconds)
+                    except asyncio.TimeoutError:
+                        exit_code, std_out, stderr = None, "", ""
+                env_info["execution_seconds"] = round(time.perf_counter() - start, 3)
+                env_info["warm_worker"] = config["warm_workers"]
+            finally:
+                task_slots.release()
+        if report is not None:
+            report["environment"] = env_info
+        if exit_code is None:
+            metrics.inc("task_runner_execution_failures_total", exception="WallTimeout")
+            return {"error": f"TimeoutError: the script was stopped after exceeding the {config['exec_wall_seconds']:g}s wall-clock limit"}
+        std_err = stderr.split("\n")
 
-        for i in range(len(std_err)):
-            if std_err[i].lstrip().startswith("File"):
-                raise Exception(std_err[i:])
+        if watcher.failed or any(line.lstrip().startswith("File") for line in std_err):
+            error = summarize_traceback(std_err, script_path)
+            exception = re.match(r"^([\w.]+)(?::|$)", error)
+            metrics.inc("task_runner_execution_failures_total", exception=exception.group(1) if exception else "unknown")
+            return {"error": error}
+        if exit_code < 0:
+            error = limit_error(-exit_code)
+            metrics.inc("task_runner_execution_failures_total", exception=error.split(":")[0])
+            return {"error": error}
+        if exit_code != 0:
+            # e.g. sys.exit("message") or sys.exit(2), which print no traceback.
+            metrics.inc("task_runner_execution_failures_total", exception="SystemExit")
+            details = compact_error(stderr)
+            return {"error": f"SystemExit: the script exited with status {exit_code}" + (f"\n{details}" if details else "")}
+        if memo_token:
+            with span("memo_record"):
+                await asyncio.to_thread(result_memo.record, task, before, audit, memo_token)
         return "success"
     except Exception as e:
         logging.info(e)
-        error = str(e)
+        metrics.inc("task_runner_execution_failures_total", exception=type(e).__name__)
+        error = compact_error(str(e))
         return {"error":error}
+    finally:
+        if memo_token:
+            result_memo.end(memo_token)
 
 
 @app.get("/")
 def home():
     return "Welcome to Task Runner"
 
-@app.post("/run")
-def task_runner(task: str):
-    try:
-        if not AIPROXY_TOKEN:
-            logging.error("AIPROXY_TOKEN environment variable is not set")
-            raise HTTPException(status_code=500, detail="API token is not configured")
-
-        url = "https://aiproxy.sanand.workers.dev/openai/v1/chat/completions"
-        data = {
-            "model": "gpt-4o-mini",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": f"Sometimes it may happen task is given in other language as well as in a different format. So, be intelligent enough to understand and write the python code to execute exactly what has been said: {task}"
-                }
-            ],
-            "response_format": response_format
-        }
-        
-        logging.info(f"Sending request to LLM API: {url}")
-        response = requests.post(
-            url=url,
-            headers=headers,
-            json=data,
-            timeout=20  # 20 second timeout
-        )
-        response.raise_for_status()
-        r = response.json()
-        logging.info(f"Received response from LLM API: {r}")
+# Registry of native handlers for task shapes we see all the time. Each entry
+# is (name, pattern, handler); the handler gets the regex match and the task
+# and returns a short description of what it did. Any exception falls back
+# to the LLM path.
+fast_paths = []
+fast_path_stats = {"tasks": 0, "matched": 0, "handled": 0, "errors": 0, "by_handler": {}}
 
-        content = json.loads(r.get("choices")[0].get("message").get("content"))
-        python_code = content.get("python_code")
-        python_dependencies = content.get("python_dependencies")
-        output = code_executer(python_dependencies, python_code)
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+# A /data path, optionally in backticks, captured without the backticks.
+PATH = r"`?(?P<{}>/data/[^\s`]*?)`?"
 
-        limit = 0
-        while limit < 3:
-            if output == "success":
-                return {"message":"Task executed successfully"}
-            elif output.get("error")!="":
-                with open ("task.py","r") as f:
-                    python_code = f.read()
-                response = resend_request(task, python_code, output.get("error"))
-                r = response.json()
-                content = json.loads(r.get("choices")[0].get("message").get("content"))
-                python_code = content.get("python_code")
-                python_dependencies = content.get("python_dependencies")
-                output = code_executer(python_dependencies, python_code)
-                limit += 1
-            else:
-                raise HTTPException(status_code=500, detail="Unknown error during code execution")
-            logging.error(f"Task failed after {limit} attempts")
-            raise HTTPException(status_code=500, detail=f"Task failed after {limit} attempts. Last error: {output.get('error', 'Unknown error')}")
-    except requests.Timeout:
-        logging.error("LLM API request timed out")
-        raise HTTPException(status_code=504, detail="LLM API request timed out")
-    except requests.RequestException as e:
-        logging.error(f"LLM API request failed: {str(e)}")
-        raise HTTPException(status_code=502, detail=f"LLM API communication error: {str(e)}")
-    except json.JSONDecodeError:
-        logging.error("Invalid JSON response from LLM API")
-        raise HTTPException(status_code=502, detail="Invalid response from LLM API")
-    except Exception as e:
-        logging.error(f"Unexpected error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
-config = {"root": "/data"}
+def fast_path(pattern):
+    """
+    Register a native handler for tasks matching `pattern`.
 
-@app.get("/read")
-def read_file(path: str = Query(..., description="Path to the file to read")):
+    The pattern must match the whole task (whitespace collapsed), so a task
+    with any extra clause or qualifier falls through to the LLM.
     """
-    Read the content of a file from the specified path.
-    
-    Args:
-        path (str): Path to the file relative to /data or absolute path
-        
-    Returns:
-        PlainTextResponse: Content of the file if found
-        HTTPException: 404 if file not found
+    def register(handler):
+        fast_paths.append((handler.__name__, re.compile(pattern, re.IGNORECASE | re.DOTALL), handler))
+        return handler
+    return register
+
+
+def match_fast_path(task):
+    """The first registered handler whose pattern matches the whole task, or None."""
+    normalized = " ".join(task.split())
+    for name, pattern, handler in fast_paths:
+        match = pattern.fullmatch(normalized)
+        if match:
+            return name, match, handler
+    return None
+
+
+def write_output(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+@fast_path(
+    r"The file " + PATH.format("source") + r" contains a list of dates, one per line\. "
+    r"Count the number of (?P<weekday>monday|tuesday|wednesday|thursday|friday|saturday|sunday)s in the list, "
+    r"and write just the number to " + PATH.format("target") + r"\.?"
+)
+def count_weekdays(match, task):
+    source, target = resolve_data_path(match["source"]), resolve_data_path(match["target"])
+    weekday = WEEKDAYS.index(match["weekday"].lower())
+    with open(source, "r") as f:
+        count = sum(1 for line in f if line.strip() and parse_date(line.strip()).weekday() == weekday)
+    write_output(target, str(count))
+    return f"counted {count} {match['weekday']}s"
+
+
+@fast_path(
+    r"Sort the array of \w+ in " + PATH.format("source") + r" by `?(?P<first>\w+)`?, then `?(?P<second>\w+)`?, "
+    r"and write the result to " + PATH.format("target") + r"\.?"
+)
+def sort_json_array(match, task):
+    source, target = resolve_data_path(match["source"]), resolve_data_path(match["target"])
+    keys = [match["first"], match["second"]]
+    with open(source, "r") as f:
+        items = json.load(f)
+    if not isinstance(items, list) or not all(isinstance(item, dict) and all(k in item for k in keys) for item in items):
+        raise ValueError("Not a list of objects with the sort keys")
+    items.sort(key=lambda item: tuple(item[k] for k in keys))
+    write_output(target, json.dumps(items, indent=2))
+    return f"sorted {len(items)} items by {keys}"
+
+
+@fast_path(
+    r"Write the first line of the (?P<count>\d+) most recent `?\.(?P<extension>\w+)`? files? in " + PATH.format("directory")
+    + r" to " + PATH.format("target") + r", most recent first\.?"
+)
+def first_lines_of_recent_files(match, task):
+    directory, target = resolve_data_path(match["directory"]), resolve_data_path(match["target"])
+    if not directory.is_dir():
+        raise ValueError("Not a directory")
+    files = sorted((p for p in directory.glob(f"*.{match['extension']}") if p.is_file()), key=lambda p: p.stat().st_mtime, reverse=True)
+    if not files:
+        raise ValueError(f"No .{match['extension']} files to read")
+    lines = []
+    for path in files[:int(match["count"])]:
+        with open(path, "r") as f:
+            lines.append(f.readline().rstrip("\n") + "\n")
+    write_output(target, "".join(lines))
+    return f"wrote first lines of {len(lines)} files"
+
+
+@fast_path(
+    r"Find all Markdown \(`?\.md`?\) files in " + PATH.format("directory") + r"\. "
+    r"For each file, extract the first occurr?[ae]nce of each H1 \(i\.e\. a line starting with `# `\)\. "
+    r"Create an index file " + PATH.format("target") + r" that maps each filename "
+    r"\(without the `?/data/[^\s`]*`? prefix\) to its title(?: \(e\.g\. [^()]*\))?\.?"
+)
+def markdown_title_index(match, task):
+    directory, target = resolve_data_path(match["directory"]), resolve_data_path(match["target"])
+    if not directory.is_dir() or target.suffix != ".json":
+        raise ValueError("Not a directory and a JSON index")
+    index = {}
+    for path in sorted(directory.rglob("*.md")):
+        with open(path, "r") as f:
+            for line in f:
+                if line.startswith("# "):
+                    index[path.relative_to(directory).as_posix()] = line[2:].strip()
+                    break
+    write_output(target, json.dumps(index, indent=2))
+    return f"indexed {len(index)} markdown files"
+
+
+@fast_path(
+    r"The SQLite database file " + PATH.format("database") + r" has an? `?(?P<table>\w+)`?(?: table)? "
+    r"with columns `?type`?, `?units`?,? and `?price`?\. Each row is a customer bid for a concert ticket\. "
+    r"What is the total sales of all the items in the [\"'`](?P<type>\w+)[\"'`] ticket type\? "
+    r"Write the number in " + PATH.format("target") + r"\.?"
+)
+def total_ticket_sales(match, task):
+    database, target = resolve_data_path(match["database"]), resolve_data_path(match["target"])
+    with sqlite3.connect(f"file:{database}?mode=ro", uri=True) as connection:
+        (total,) = connection.execute(
+            f'SELECT COALESCE(SUM(units * price), 0) FROM "{match["table"]}" WHERE LOWER(type) = LOWER(?)',
+            (match["type"],),
+        ).fetchone()
+    write_output(target, str(total))
+    return f"total {match['type']} sales {total}"
+
+
+async def try_fast_path(task):
+    """
+    Run the first native handler whose pattern matches the task.
+
+    Returns the handler name and its summary, or None when no handler matched
+    or the matching handler failed, so the caller falls back to the LLM.
+    """
+    fast_path_stats["tasks"] += 1
+    matched = match_fast_path(task)
+    if matched:
+        name, match, handler = matched
+        fast_path_stats["matched"] += 1
+        metrics.inc("task_runner_cache_total", cache="fast_path", result="hit")
+        try:
+            summary = await asyncio.to_thread(handler, match, task)
+        except Exception as e:
+            fast_path_stats["errors"] += 1
+            logging.info(f"Fast path {name} failed, falling back to LLM: {str(e)}")
+            return None
+        fast_path_stats["handled"] += 1
+        fast_path_stats["by_handler"][name] = fast_path_stats["by_handler"].get(name, 0) + 1
+        return name, summary
+    metrics.inc("task_runner_cache_total", cache="fast_path", result="miss")
+    return None
+
+
+def record_attempt(attempts, source, output, report, llm_seconds=None, usage=None):
+    attempt = {
+        "attempt": len(attempts) + 1,
+        "source": source,
+        "status": "success" if output == "success" else "error",
+        **report,
+    }
+    if llm_seconds is not None:
+        attempt["llm_seconds"] = round(llm_seconds, 3)
+    if usage:
+        for kind in ("prompt", "completion"):
+            metrics.inc("task_runner_llm_tokens_total", usage.get(f"{kind}_tokens", 0), phase=source, kind=kind)
+        attempt["tokens"] = {
+            "prompt": usage.get("prompt_tokens", 0),
+            "completion": usage.get("completion_tokens", 0),
+            "total": usage.get("total_tokens", 0),
+        }
+    if output != "success":
+        attempt["error"] = output.get("error")
+    attempts.append(attempt)
+
+
+async def request_plan(task, temperature=None):
+    """Ask the LLM for a plan; returns its content, token usage and latency."""
+    url = f"{config['llm_base_url'].rstrip('/')}/chat/completions"
+    data = {
+        "model": config["llm_model"],
+        "messages": [
+            {
+                "role": "system",
+                "content": system_prompt
+            },
+            {
+                "role": "user",
+                "content": f"Sometimes it may happen task is given in other language as well as in a different format. So, be intelligent enough to understand and write the python code to execute exactly what has been said: {task}"
+            }
+        ],
+        "response_format": response_format
+    }
+    if config["index_enabled"] and data_index.refreshed_at:
+        data["messages"][1]["content"] += f"\n\nFiles currently in /data (path, size, modified, type):\n{data_index.context()}"
+    if temperature is not None:
+        data["temperature"] = temperature
+    
+    logging.info(f"Sending request to LLM API: {url}")
+    start = time.perf_counter()
+    with span("llm_plan"):
+        response = await llm_client.post(url=url, json=data)
+        response.raise_for_status()
+    llm_seconds = time.perf_counter() - start
+    with span("parse"):
+        r = response.json()
+        content = json.loads(r.get("choices")[0].get("message").get("content"))
+    logging.info(f"Received response from LLM API: {r}")
+    usage = r.get("usage")
+    if usage:
+        plan_token_usage["calls"] += 1
+        plan_token_usage["tokens"] += usage.get("total_tokens", 0)
+    return content, usage, llm_seconds
+
+
+# Running total of tokens spent per plan request, used to keep speculative
+# rounds under the configured token ceiling.
+plan_token_usage = {"calls": 0, "tokens": 0}
+
+
+def speculative_candidates(requested):
+    """Clamp the number of speculative candidates to the token ceiling."""
+    if requested <= 1:
+        return 1
+    if plan_token_usage["calls"]:
+        estimate = plan_token_usage["tokens"] / plan_token_usage["calls"]
+    else:
+        estimate = config["speculative_token_estimate"]
+    return max(1, min(requested, int(config["speculative_max_tokens"] // max(estimate, 1))))
+
+
+async def plan_candidate(task, temperature):
+    content, usage, llm_seconds = await request_plan(task, temperature)
+    emit("plan", source="speculative", temperature=temperature, dependencies=content.get("python_dependencies"), llm_seconds=round(llm_seconds, 3))
+    return {
+        "temperature": temperature,
+        "python_code": content.get("python_code"),
+        "python_dependencies": content.get("python_dependencies"),
+        "usage": usage,
+        "llm_seconds": llm_seconds,
+    }
+
+
+async def run_speculative(task, candidates, attempts):
+    """
+    Plan `candidates` scripts concurrently at different temperatures and run
+    them one at a time as their plans arrive. The first one that succeeds wins
+    and the plans still outstanding are cancelled.
+
+    Only the planning is raced: every script writes to the shared /data, so
+    running candidates side by side could let a loser overwrite the winner's
+    outputs. Returns the winner (or None) and the failed candidates in the
+    order they ran.
     """
+    temperatures = config["speculative_temperatures"]
+    pending = {asyncio.create_task(plan_candidate(task, temperatures[i % len(temperatures)])) for i in range(candidates)}
+    failures, errors = [], []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for finished in done:
+                if finished.exception() is not None:
+                    errors.append(finished.exception())
+                    continue
+                result = finished.result()
+                report = {}
+                async with task_workspace() as workspace:
+                    result["output"] = await code_executer(result["python_dependencies"], result["python_code"], workspace, report, task)
+                result["report"] = report
+                record_attempt(
+                    attempts, "speculative", result["output"], {**report, "temperature": result["temperature"]},
+                    result["llm_seconds"], result["usage"],
+                )
+                if result["output"] == "success":
+                    return result, failures
+                failures.append(result)
+    finally:
+        for candidate in pending:
+            candidate.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    if not failures:
+        raise errors[0]
+    return None, failures
+
+
+async def run_task(task, no_cache=False, attempts=None, speculative=None, plan=None):
+    """
+    Plan and execute a task, repairing the generated code up to three times.
+
+    With `speculative` (or `speculative_candidates`) above one, several
+    candidate plans are raced first. `plan` is an already started
+    request_plan call to use instead of asking the LLM again. Every execution
+    is appended to `attempts` (when given) with its source, error and
+    timings. Returns the /run response body and raises HTTPException when
+    the task cannot be completed.
+    """
+    if attempts is None:
+        attempts = []
+    if config["fast_paths"] and not no_cache:
+        start = time.perf_counter()
+        # Fast paths write /data too, so they count as overlapping executions.
+        memo_token = result_memo.begin()
+        try:
+            with span("fast_path"):
+                handled = await try_fast_path(task)
+        finally:
+            result_memo.end(memo_token)
+        if handled:
+            name, summary = handled
+            metrics.inc("task_runner_tasks_total", outcome="fast_path")
+            seconds = round(time.perf_counter() - start, 3)
+            record_attempt(attempts, "fast_path", "success", {"fast_path": name, "execution_seconds": seconds})
+            return {"message":"Task executed successfully", "fast_path": name, "summary": summary, "execution_seconds": seconds}
+    if result_memo.enabled() and not no_cache:
+        start = time.perf_counter()
+        with span("memo"):
+            restored = await asyncio.to_thread(result_memo.restore, task)
+        metrics.inc("task_runner_cache_total", cache="result", result="miss" if restored is None else "hit")
+        if restored is not None:
+            metrics.inc("task_runner_tasks_total", outcome="memo")
+            seconds = round(time.perf_counter() - start, 3)
+            record_attempt(attempts, "memo", "success", {"restored": restored, "execution_seconds": seconds})
+            return {"message":"Task executed successfully", "memo": "hit", "restored": restored, "execution_seconds": seconds}
     try:
-        # Handle both relative and absolute paths
-        if path.startswith("/data"):
-            file_path = Path(path)
+        if not AIPROXY_TOKEN:
+            logging.error("AIPROXY_TOKEN environment variable is not set")
+            metrics.inc("task_runner_failures_total", type="config")
+            raise HTTPException(status_code=500, detail="API token is not configured")
+
+        async with task_workspace() as workspace:
+            if no_cache:
+                plan_cache_status = "bypass"
+            else:
+                cached = plan_cache.get(task)
+                plan_cache_status = "miss"
+                metrics.inc("task_runner_cache_total", cache="plan", result="hit" if cached else "miss")
+                if cached:
+                    logging.info("Plan cache hit, skipping LLM request")
+                    emit("plan", source="cache", dependencies=cached["python_dependencies"])
+                    report = {}
+                    output = await code_executer(cached["python_dependencies"], cached["python_code"], workspace, report, task)
+                    record_attempt(attempts, "cache", output, report)
+                    if output == "success":
+                        metrics.inc("task_runner_tasks_total", outcome="plan_cache")
+                        return {"message":"Task executed successfully", "plan_cache": "hit", **report}
+                    # The cached plan no longer works (e.g. the data changed), plan from scratch.
+                    logging.info(f"Cached plan failed, invalidating: {output.get('error')}")
+                    plan_cache.invalidate(task)
+
+            candidates = speculative_candidates(config["speculative_candidates"] if speculative is None else speculative)
+            if candidates > 1:
+                with span("speculative"):
+                    winner, failures = await run_speculative(task, candidates, attempts)
+                if winner:
+                    if not no_cache:
+                        plan_cache.put(task, winner["python_code"], winner["python_dependencies"])
+                    metrics.inc("task_runner_tasks_total", outcome="speculative")
+                    return {
+                        "message":"Task executed successfully",
+                        "plan_cache": plan_cache_status,
+                        "speculative": {"candidates": candidates, "temperature": winner["temperature"]},
+                        **winner["report"],
+                    }
+                # No candidate passed: keep repairing the first one that ran.
+                python_code = failures[0]["python_code"]
+                python_dependencies = failures[0]["python_dependencies"]
+                output = failures[0]["output"]
+                report = failures[0]["report"]
+            else:
+                content, usage, llm_seconds = await (plan if plan is not None else request_plan(task))
+                python_code = content.get("python_code")
+                python_dependencies = content.get("python_dependencies")
+                emit("plan", source="llm", dependencies=python_dependencies, llm_seconds=round(llm_seconds, 3))
+                report = {}
+                output = await code_executer(python_dependencies, python_code, workspace, report, task)
+                record_attempt(attempts, "llm", output, report, llm_seconds, usage)
+
+            limit = 0
+            while limit < 3:
+                if output == "success":
+                    break
+                elif output.get("error")!="":
+                    metrics.inc("task_runner_retries_total")
+                    emit("repair", attempt=limit + 1, error=output.get("error"))
+                    start = time.perf_counter()
+                    response = await resend_request(task, python_code, output.get("error"))
+                    llm_seconds = time.perf_counter() - start
+                    with span("parse"):
+                        r = response.json()
+                        content = json.loads(r.get("choices")[0].get("message").get("content"))
+                    python_code = content.get("python_code")
+                    python_dependencies = content.get("python_dependencies")
+                    emit("plan", source="repair", dependencies=python_dependencies, llm_seconds=round(llm_seconds, 3))
+                    report = {}
+                    output = await code_executer(python_dependencies, python_code, workspace, report, task)
+                    record_attempt(attempts, "repair", output, report, llm_seconds, r.get("usage"))
+                    limit += 1
+                else:
+                    raise HTTPException(status_code=500, detail="Unknown error during code execution")
+            if output == "success":
+                if not no_cache:
+                    plan_cache.put(task, python_code, python_dependencies)
+                metrics.inc("task_runner_tasks_total", outcome="llm")
+                return {"message":"Task executed successfully", "plan_cache": plan_cache_status, **report}
+            logging.error(f"Task failed after {limit} attempts")
+            metrics.inc("task_runner_failures_total", type="execution")
+            raise HTTPException(status_code=500, detail=f"Task failed after {limit} attempts. Last error: {output.get('error', 'Unknown error')}")
+    except HTTPException:
+        raise
+    except httpx.TimeoutException:
+        logging.error("LLM API request timed out")
+        metrics.inc("task_runner_failures_total", type="llm_timeout")
+        raise HTTPException(status_code=504, detail="LLM API request timed out")
+    except httpx.HTTPError as e:
+        logging.error(f"LLM API request failed: {str(e)}")
+        metrics.inc("task_runner_failures_total", type="llm_error")
+        raise HTTPException(status_code=502, detail=f"LLM API communication error: {str(e)}")
+    except json.JSONDecodeError:
+        logging.error("Invalid JSON response from LLM API")
+        metrics.inc("task_runner_failures_total", type="invalid_response")
+        raise HTTPException(status_code=502, detail="Invalid response from LLM API")
+    except Exception as e:
+        logging.error(f"Unexpected error: {str(e)}")
+        metrics.inc("task_runner_failures_total", type="unexpected")
+        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+
+class AdmissionControl:
+    """
+    Global cap on tasks in flight, so overload is shed with 429 up front
+    instead of every request queueing behind the task slots and timing out.
+
+    Retry-After is estimated from a moving average of task durations and the
+    number of tasks ahead of a new one.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.average_seconds = None
+
+    def check(self, count=1):
+        """Raise the 429 that acquire() would, without taking a slot."""
+        if self.limit and self.in_flight + count > self.limit:
+            metrics.inc("task_runner_rejected_total")
+            raise HTTPException(status_code=429, detail="Too many tasks in flight", headers={"Retry-After": str(self.retry_after())})
+
+    def acquire(self, count=1):
+        self.check(count)
+        self.in_flight += count
+        return time.perf_counter()
+
+    def release(self, start, count=1):
+        self.in_flight -= count
+        if count == 1:
+            seconds = time.perf_counter() - start
+            self.average_seconds = seconds if self.average_seconds is None else 0.8 * self.average_seconds + 0.2 * seconds
+
+    def retry_after(self):
+        slots = config["max_concurrent_tasks"]
+        waves = max(self.in_flight - slots + 1, 1) / slots
+        return max(1, min(60, math.ceil((self.average_seconds or 5) * waves)))
+
+
+admission = AdmissionControl(config["max_in_flight_tasks"])
+metrics.gauge("task_runner_tasks_in_flight", lambda: admission.in_flight)
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent /run requests into one execution.
+
+    Requests are identical when their whitespace-normalized task, options and
+    the /data digest of the index match. The first one starts the flight and
+    later ones attach to it and get the same result (or error); the flight
+    keeps running if its first caller disconnects.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.stats = {"leaders": 0, "followers": 0}
+
+    @staticmethod
+    def key(task, *options):
+        digest = data_index.digest if config["index_enabled"] else ""
+        return hashlib.sha256(json.dumps([" ".join(task.split()), digest, *options]).encode()).hexdigest()
+
+    async def run(self, key, execute):
+        flight = self.flights.get(key)
+        follower = flight is not None
+        if follower:
+            self.stats["followers"] += 1
         else:
-            file_path = Path(config["root"]) / path
-        
-        # Normalize the path to prevent directory traversal
-        file_path = file_path.resolve()
+            self.stats["leaders"] += 1
+            flight = asyncio.ensure_future(execute())
+            self.flights[key] = flight
+            flight.add_done_callback(lambda done: self.finish(key, done))
+        metrics.inc("task_runner_coalesced_total", role="follower" if follower else "leader")
+        result = await asyncio.shield(flight)
+        return {**result, "coalesced": True} if follower else result
+
+    def finish(self, key, flight):
+        self.flights.pop(key, None)
+        if not flight.cancelled():
+            # Mark the error retrieved even if every caller went away.
+            flight.exception()
+
+    def dedup_ratio(self):
+        total = self.stats["leaders"] + self.stats["followers"]
+        return self.stats["followers"] / total if total else 0.0
+
+
+single_flight = SingleFlight()
+metrics.gauge("task_runner_coalesce_dedup_ratio", single_flight.dedup_ratio)
+metrics.gauge("task_runner_coalesce_in_flight", lambda: len(single_flight.flights))
+
+
+@app.post("/run")
+async def task_runner(
+    task: str,
+    no_cache: bool = Query(False, description="Bypass fast paths, the result memo and the plan cache and always ask the LLM"),
+    speculative: int = Query(None, ge=0, description="Race this many candidate plans, overriding the server default"),
+):
+    async def execute():
+        start = admission.acquire()
+        try:
+            return await run_task(task, no_cache, speculative=speculative)
+        finally:
+            admission.release(start)
+
+    return await single_flight.run(single_flight.key(task, no_cache, speculative), execute)
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/run/stream")
+async def task_runner_stream(
+    task: str,
+    no_cache: bool = Query(False, description="Bypass fast paths, the result memo and the plan cache and always ask the LLM"),
+    speculative: int = Query(None, ge=0, description="Race this many candidate plans, overriding the server default"),
+):
+    """
+    Run a task like /run, streaming its progress as server-sent events.
+
+    Events are `plan` (source and dependencies), `environment`, `execute`,
+    `stdout` and `stderr` lines as the script prints them, `repair` (attempt
+    and error) and a final `result` with the /run response body or the
+    error. A comment is sent every 15 seconds of silence to keep proxies
+    from closing the connection.
+    """
+    events = asyncio.Queue()
+    # Reject with a plain 429 while we still can, but only take the slot once
+    # the body is streamed: if the client leaves before that, the generator
+    # never runs and a slot taken here would never be released.
+    admission.check()
+
+    async def stream():
+        try:
+            admitted = admission.acquire()
+        except HTTPException as e:
+            yield sse("result", {"status": "failed", "status_code": e.status_code, "detail": e.detail})
+            return
+        progress_events.set(events)
+        runner = asyncio.create_task(run_task(task, no_cache, speculative=speculative))
+        try:
+            yield sse("accepted", {"task": task})
+            while True:
+                getter = asyncio.create_task(events.get())
+                done, _ = await asyncio.wait([getter, runner], timeout=15, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    event, data = getter.result()
+                    yield sse(event, data)
+                    continue
+                getter.cancel()
+                if runner in done:
+                    break
+                yield ": keepalive\n\n"
+            while not events.empty():
+                event, data = events.get_nowait()
+                yield sse(event, data)
+            try:
+                yield sse("result", {"status": "succeeded", **runner.result()})
+            except HTTPException as e:
+                yield sse("result", {"status": "failed", "status_code": e.status_code, "detail": e.detail})
+        finally:
+            # The client went away: stop the task and kill its script.
+            runner.cancel()
+            admission.release(admitted)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+class BatchTask(BaseModel):
+    id: str
+    task: str
+    depends_on: List[str] = []
+
+
+class BatchRequest(BaseModel):
+    tasks: List[BatchTask]
+    no_cache: bool = False
+    speculative: int = Field(None, ge=0)
+
+
+def batch_order(tasks):
+    """Topological order of the batch; raises HTTPException on bad ids or cycles."""
+    ids = [item.id for item in tasks]
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="Task ids must be unique")
+    remaining = {item.id: set(item.depends_on) for item in tasks}
+    for item_id, depends_on in remaining.items():
+        unknown = depends_on - remaining.keys()
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Task {item_id} depends on unknown tasks: {sorted(unknown)}")
+    order = []
+    while remaining:
+        ready = [item_id for item_id, depends_on in remaining.items() if not depends_on]
+        if not ready:
+            raise HTTPException(status_code=400, detail=f"Dependency cycle between tasks: {sorted(remaining)}")
+        for item_id in ready:
+            order.append(item_id)
+            del remaining[item_id]
+        for depends_on in remaining.values():
+            depends_on.difference_update(ready)
+    return order
+
+
+def needs_plan(task, no_cache, speculative):
+    """Whether run_task would ask the LLM for a single plan for this task."""
+    if speculative_candidates(config["speculative_candidates"] if speculative is None else speculative) > 1:
+        return False
+    if config["fast_paths"] and not no_cache and match_fast_path(task):
+        return False
+    if result_memo.enabled() and not no_cache and result_memo.key(task) in result_memo.entries:
+        # Likely served by the memo; if restoring fails run_task plans itself.
+        return False
+    return no_cache or plan_cache.key(task) not in plan_cache.entries
+
+
+@app.post("/run/batch")
+async def batch_runner(batch: BatchRequest):
+    """
+    Run a DAG of tasks and return per-task results and timings.
+
+    Plans for every task without dependencies are requested from the LLM up
+    front and concurrently; each task then executes as soon as its
+    dependencies have succeeded, so independent tasks run in parallel
+    (bounded by `max_concurrent_tasks`). Dependent tasks are planned only
+    then, so the planner sees /data as their dependencies left it. Tasks
+    whose dependencies failed are skipped.
+    """
+    order = batch_order(batch.tasks)
+    items = {item.id: item for item in batch.tasks}
+    if admission.limit and len(items) > admission.limit:
+        raise HTTPException(status_code=413, detail=f"Batches are limited to {admission.limit} tasks")
+    admitted = admission.acquire(len(items))
+    try:
+        return await run_batch(batch, order, items)
+    finally:
+        admission.release(admitted, len(items))
+
+
+async def run_batch(batch, order, items):
+    started = time.perf_counter()
+    plans = {
+        item.id: asyncio.create_task(request_plan(item.task))
+        for item in batch.tasks
+        if AIPROXY_TOKEN and not item.depends_on and needs_plan(item.task, batch.no_cache, batch.speculative)
+    }
+    runs, results = {}, {}
+
+    async def run(item):
+        upstream = [runs[dependency] for dependency in item.depends_on]
+        if not all(await asyncio.gather(*upstream)):
+            failed = [dependency for dependency in item.depends_on if results[dependency]["status"] != "succeeded"]
+            results[item.id] = {"status": "skipped", "detail": f"Dependencies did not succeed: {failed}"}
+            return False
+        if item.depends_on and config["index_enabled"]:
+            # Don't wait for the next poll: the plan should see the files the
+            # dependencies just wrote.
+            await asyncio.to_thread(data_index.refresh)
+        start = time.perf_counter()
+        attempts = []
+        result = {"started": round(start - started, 3)}
+        try:
+            result["result"] = await run_task(item.task, batch.no_cache, attempts, batch.speculative, plans.get(item.id))
+            result["status"] = "succeeded"
+        except HTTPException as e:
+            result["status"] = "failed"
+            result["error"] = {"status_code": e.status_code, "detail": e.detail}
+        finished = time.perf_counter()
+        result["finished"] = round(finished - started, 3)
+        result["seconds"] = round(finished - start, 3)
+        result["attempts"] = attempts
+        results[item.id] = result
+        return result["status"] == "succeeded"
+
+    for item_id in order:
+        runs[item_id] = asyncio.create_task(run(items[item_id]))
+    try:
+        await asyncio.gather(*runs.values())
+    finally:
+        # Plans of skipped tasks (or of tasks served from a cache) are unused.
+        for plan in plans.values():
+            plan.cancel()
+        await asyncio.gather(*plans.values(), return_exceptions=True)
+
+    # Longest chain of task durations through the DAG, the best possible wall time.
+    path = {}
+    for item_id in order:
+        path[item_id] = results[item_id].get("seconds", 0) + max((path[d] for d in items[item_id].depends_on), default=0)
+    return {
+        "wall_seconds": round(time.perf_counter() - started, 3),
+        "critical_path_seconds": round(max(path.values(), default=0), 3),
+        "succeeded": sum(result["status"] == "succeeded" for result in results.values()),
+        "failed": sum(result["status"] == "failed" for result in results.values()),
+        "skipped": sum(result["status"] == "skipped" for result in results.values()),
+        "results": {item_id: results[item_id] for item_id in order},
+    }
+
+
+JOB_PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class JobQueue:
+    """
+    Priority queue of background /run jobs drained by a fixed set of workers.
+
+    Jobs are kept in memory; once more than `max_history` jobs have finished
+    the oldest finished ones are forgotten.
+    """
+
+    def __init__(self, workers, max_queued, max_history):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_history = max_history
+        self.queue = asyncio.PriorityQueue()
+        self.jobs = OrderedDict()
+        self.counter = itertools.count()
+        self.running = 0
+        self.tasks = []
+
+    def submit(self, task, priority="normal", no_cache=False, speculative=None):
+        if self.queue.qsize() >= self.max_queued:
+            raise HTTPException(status_code=429, detail="Job queue is full", headers={"Retry-After": "5"})
+        job = {
+            "id": uuid.uuid4().hex,
+            "task": task,
+            "priority": priority,
+            "no_cache": no_cache,
+            "speculative": speculative,
+            "state": "queued",
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "queue_seconds": None,
+            "run_seconds": None,
+            "attempts": [],
+            "result": None,
+            "error": None,
+        }
+        self.jobs[job["id"]] = job
+        self.queue.put_nowait((JOB_PRIORITIES[priority], next(self.counter), job["id"]))
+        return job
+
+    async def worker(self):
+        while True:
+            _, _, job_id = await self.queue.get()
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            self.running += 1
+            job["state"] = "running"
+            job["started_at"] = time.time()
+            job["queue_seconds"] = round(job["started_at"] - job["submitted_at"], 3)
+            try:
+                job["result"] = await run_task(job["task"], job["no_cache"], job["attempts"], job["speculative"])
+                job["state"] = "succeeded"
+            except HTTPException as e:
+                job["state"] = "failed"
+                job["error"] = {"status_code": e.status_code, "detail": e.detail}
+            except Exception as e:
+                logging.error(f"Job {job_id} crashed: {str(e)}")
+                job["state"] = "failed"
+                job["error"] = {"status_code": 500, "detail": str(e)}
+            finally:
+                self.running -= 1
+                job["finished_at"] = time.time()
+                job["run_seconds"] = round(job["finished_at"] - job["started_at"], 3)
+                self.forget_finished()
+
+    def forget_finished(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job["finished_at"] is not None]
+        for job_id in finished[:max(len(finished) - self.max_history, 0)]:
+            del self.jobs[job_id]
+
+    def stats(self):
+        states = {}
+        for job in self.jobs.values():
+            states[job["state"]] = states.get(job["state"], 0) + 1
+        return {
+            "queue_depth": self.queue.qsize(),
+            "running": self.running,
+            "workers": self.workers,
+            "max_queued": self.max_queued,
+            "jobs": states,
+        }
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+job_queue = JobQueue(config["job_workers"], config["job_queue_size"], config["job_history"])
+metrics.gauge("task_runner_job_queue_depth", lambda: job_queue.queue.qsize())
+metrics.gauge("task_runner_jobs_running", lambda: job_queue.running)
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    task: str,
+    priority: Literal["high", "normal", "low"] = Query("normal", description="Scheduling priority of the job"),
+    no_cache: bool = Query(False, description="Bypass fast paths, the result memo and the plan cache and always ask the LLM"),
+    speculative: int = Query(None, ge=0, description="Race this many candidate plans, overriding the server default"),
+):
+    """Queue a task and return its job id immediately."""
+    job = job_queue.submit(task, priority, no_cache, speculative)
+    return {"id": job["id"], "state": job["state"], "status_url": f"/jobs/{job['id']}"}
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Counters and latency histograms in the Prometheus text format."""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/fastpath")
+def fast_path_report():
+    """Registered native handlers and how often incoming tasks matched them."""
+    tasks = fast_path_stats["tasks"]
+    return {
+        "enabled": config["fast_paths"],
+        "handlers": [name for name, _, _ in fast_paths],
+        **fast_path_stats,
+        "match_rate": round(fast_path_stats["matched"] / tasks, 3) if tasks else 0.0,
+        "hit_rate": round(fast_path_stats["handled"] / tasks, 3) if tasks else 0.0,
+    }
+
+
+@app.get("/jobs")
+def job_stats():
+    """Queue depth, busy workers and job counts by state."""
+    return job_queue.stats()
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    """State, per-attempt errors and timings of a job."""
+    job = job_queue.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
+
+
+# Leading bytes of the binary formats we expect to find in /data.
+FILE_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF8", "gif"),
+    (b"%PDF", "pdf"),
+    (b"SQLite format 3\x00", "sqlite"),
+    (b"PK\x03\x04", "zip"),
+    (b"\x1f\x8b", "gzip"),
+]
+TEXT_TYPES = {".json": "json", ".md": "markdown", ".csv": "csv", ".log": "log", ".html": "html", ".py": "python"}
+
+
+class EmbeddingStore:
+    """
+    On-disk cache of embedding vectors keyed by a hash of model and text.
+
+    Vectors are stored as float32 blobs in SQLite so they survive restarts
+    and can be shared by every task that embeds the same lines.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.db = None
+
+    def connect(self):
+        if self.db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        return self.db
+
+    def get_many(self, keys):
+        found = {}
+        with self.lock:
+            db = self.connect()
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = db.execute(f"SELECT key, vector FROM vectors WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+        return found
+
+    def put_many(self, vectors):
+        with self.lock:
+            db = self.connect()
+            db.executemany(
+                "INSERT OR REPLACE INTO vectors (key, vector) VALUES (?, ?)",
+                [(key, vector.astype(np.float32).tobytes()) for key, vector in vectors.items()],
+            )
+            db.commit()
+
+
+class EmbeddingService:
+    """
+    Embeds texts through the LLM API with deduplication, batching and caching.
+
+    Identical texts are embedded once, whether they repeat within a request,
+    are already in the on-disk store, or are being embedded for a concurrent
+    request. The rest is sent in batches of `embedding_batch_size`, several
+    batches at a time. Vectors are L2-normalized so dot products are cosine
+    similarities.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.pending = {}
+        self.stats = {"texts": 0, "unique": 0, "cached": 0, "coalesced": 0, "embedded": 0, "batches": 0}
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha256(f"{config['embedding_model']}\0{text}".encode()).hexdigest()
+
+    async def embed(self, texts):
+        """Return a float32 matrix with one normalized row per text."""
+        keys = [self.key(text) for text in texts]
+        unique = dict(zip(keys, texts))
+        self.stats["texts"] += len(texts)
+        self.stats["unique"] += len(unique)
+        with span("embedding_cache"):
+            vectors = await asyncio.to_thread(self.store.get_many, list(unique))
+        self.stats["cached"] += len(vectors)
+        metrics.inc("task_runner_cache_total", len(vectors), cache="embedding", result="hit")
+        waiting = {key: self.pending[key] for key in unique if key not in vectors and key in self.pending}
+        self.stats["coalesced"] += len(waiting)
+        missing = [key for key in unique if key not in vectors and key not in waiting]
+        metrics.inc("task_runner_cache_total", len(missing), cache="embedding", result="miss")
+        if missing:
+            # The request belongs to the service, not to this caller, so a
+            # caller that goes away does not cancel it for concurrent waiters.
+            task = asyncio.create_task(self.request([(key, unique[key]) for key in missing]))
+            for key in missing:
+                self.pending[key] = waiting[key] = task
+            task.add_done_callback(lambda task, keys=missing: self.finished(task, keys))
+        for key, task in waiting.items():
+            vectors[key] = (await asyncio.shield(task))[key]
+        return np.stack([vectors[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+
+    def finished(self, task, keys):
+        for key in keys:
+            if self.pending.get(key) is task:
+                del self.pending[key]
+        if not task.cancelled():
+            # Waiters get the error; nobody else needs to retrieve it.
+            task.exception()
+
+    async def request(self, items):
+        url = f"{config['llm_base_url'].rstrip('/')}/embeddings"
+        size = config["embedding_batch_size"]
+        batches = [items[i:i + size] for i in range(0, len(items), size)]
+        semaphore = asyncio.Semaphore(config["embedding_max_concurrent_batches"])
+
+        async def send(batch):
+            async with semaphore:
+                with span("embedding_request"):
+                    response = await llm_client.post(url=url, json={"model": config["embedding_model"], "input": [text for _, text in batch]})
+                    response.raise_for_status()
+            data = sorted(response.json()["data"], key=lambda item: item["index"])
+            return {key: item["embedding"] for (key, _), item in zip(batch, data)}
+
+        vectors = {}
+        for result in await asyncio.gather(*(send(batch) for batch in batches)):
+            vectors.update(result)
+        vectors = {key: normalize(np.asarray(vector, dtype=np.float32)) for key, vector in vectors.items()}
+        self.stats["batches"] += len(batches)
+        self.stats["embedded"] += len(vectors)
+        await asyncio.to_thread(self.store.put_many, vectors)
+        return vectors
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def top_k(queries, corpus, k, block_size=None):
+    """
+    Indices and scores of the `k` corpus rows most similar to each query.
+
+    The corpus is scanned in blocks, so only a queries × block score matrix
+    is held at a time and a running top-k is merged after each block.
+    """
+    block_size = block_size or config["similarity_block_size"]
+    k = min(k, len(corpus))
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_indices = np.zeros((len(queries), k), dtype=np.int64)
+    for start in range(0, len(corpus), block_size):
+        block = corpus[start:start + block_size]
+        scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+        indices = np.concatenate([best_indices, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))], axis=1)
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, keep, axis=1)
+        best_indices = np.take_along_axis(indices, keep, axis=1)
+    order = np.argsort(-best_scores, axis=1)
+    return np.take_along_axis(best_indices, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def closest_pairs(vectors, k=1, block_size=None):
+    """
+    The `k` most similar pairs (i < j) among the rows of `vectors`.
+
+    Compares blocks of rows against themselves and every later block, so
+    memory stays at block_size² scores however many rows there are.
+    """
+    block_size = block_size or config["similarity_block_size"]
+    best = []
+    for i in range(0, len(vectors), block_size):
+        left = vectors[i:i + block_size]
+        for j in range(i, len(vectors), block_size):
+            scores = left @ vectors[j:j + block_size].T
+            if i == j:
+                # Only the upper triangle: no self-pairs or mirrored duplicates.
+                scores[np.tril_indices(len(scores), m=scores.shape[1])] = -np.inf
+            flat = scores.ravel()
+            take = min(k, flat.size)
+            for index in np.argpartition(-flat, take - 1)[:take]:
+                if np.isfinite(flat[index]):
+                    row, column = divmod(int(index), scores.shape[1])
+                    best.append((float(flat[index]), i + row, j + column))
+            best = sorted(best, reverse=True)[:k]
+    return best
+
+
+embedding_service = EmbeddingService(EmbeddingStore(config["embedding_cache_path"]))
+
+
+class EmbeddingRequest(BaseModel):
+    texts: List[str]
+
+
+class TopKRequest(BaseModel):
+    queries: List[str]
+    texts: List[str]
+    k: int = Field(5, ge=1)
+
+
+class ClosestPairsRequest(BaseModel):
+    texts: List[str]
+    k: int = Field(1, ge=1)
+
+
+async def embed_or_raise(texts):
+    try:
+        return await embedding_service.embed(texts)
+    except httpx.HTTPError as e:
+        logging.error(f"Embedding request failed: {str(e)}")
+        metrics.inc("task_runner_failures_total", type="embedding_error")
+        raise HTTPException(status_code=502, detail=f"Embedding API communication error: {str(e)}")
+
+
+@app.post("/embeddings")
+async def embeddings(request: EmbeddingRequest):
+    """Normalized embedding vectors for the texts, in order."""
+    vectors = await embed_or_raise(request.texts)
+    return {"model": config["embedding_model"], "embeddings": vectors.tolist()}
+
+
+@app.post("/similarity/top_k")
+async def similarity_top_k(request: TopKRequest):
+    """For every query, the `k` most similar texts by cosine similarity."""
+    if not request.texts:
+        return {"results": [[] for _ in request.queries]}
+    vectors = await embed_or_raise(request.queries + request.texts)
+    with span("similarity"):
+        indices, scores = await asyncio.to_thread(top_k, vectors[:len(request.queries)], vectors[len(request.queries):], request.k)
+    return {
+        "results": [
+            [{"index": int(i), "text": request.texts[i], "score": float(s)} for i, s in zip(row_indices, row_scores)]
+            for row_indices, row_scores in zip(indices, scores)
+        ]
+    }
+
+
+@app.post("/similarity/closest_pairs")
+async def similarity_closest_pairs(request: ClosestPairsRequest):
+    """The `k` most similar pairs of texts, most similar first."""
+    if len(request.texts) < 2:
+        raise HTTPException(status_code=400, detail="At least two texts are needed")
+    vectors = await embed_or_raise(request.texts)
+    with span("similarity"):
+        pairs = await asyncio.to_thread(closest_pairs, vectors, request.k)
+    return {
+        "pairs": [
+            {"i": i, "j": j, "texts": [request.texts[i], request.texts[j]], "score": score}
+            for score, i, j in pairs
+        ]
+    }
+
+
+@app.get("/embeddings/stats")
+def embedding_stats():
+    return embedding_service.stats
+
+
+def sniff_type(path, head):
+    for signature, file_type in FILE_SIGNATURES:
+        if head.startswith(signature):
+            return file_type
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        return "webp"
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off at the end of the sample is still text.
+        if e.start < len(head) - 3:
+            return "binary"
+    return TEXT_TYPES.get(path.suffix.lower(), "text")
+
+
+class DataIndex:
+    """
+    Incrementally maintained index of the files under /data.
+
+    `refresh` walks the tree and only re-hashes and re-sniffs files whose size
+    or mtime changed since the last pass; `watch` repeats it every
+    `index_poll_seconds`.
+    """
+
+    def __init__(self, root):
+        # Resolved like resolve_data_path does, so /list prefixes match the keys.
+        self.root = Path(root).resolve()
+        self.entries = {}
+        # Hash of every path and content hash, updated whenever /data changes.
+        self.digest = ""
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Bring the index up to date and return the number of changed paths."""
+        with self.lock:
+            entries, changed = {}, 0
+            for dirpath, dirnames, filenames in os.walk(self.root):
+                dirnames.sort()
+                for name in filenames:
+                    path = Path(dirpath) / name
+                    try:
+                        stat = path.stat()
+                    except OSError:
+                        continue
+                    key = str(path)
+                    entry = self.entries.get(key)
+                    if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                        try:
+                            entry = self.describe(path, stat)
+                        except OSError:
+                            continue
+                        changed += 1
+                    entries[key] = entry
+            changed += len(self.entries.keys() - entries.keys())
+            if changed or not self.digest:
+                digest = hashlib.sha256()
+                for key, entry in sorted(entries.items()):
+                    digest.update(f"{key}\0{entry['sha256']}\n".encode())
+                self.digest = digest.hexdigest()
+            self.entries = entries
+            self.refreshed_at = time.time()
+            return changed
+
+    @staticmethod
+    def describe(path, stat):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            head = f.read(4096)
+            digest.update(head)
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return {
+            "path": str(path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": digest.hexdigest(),
+            "type": sniff_type(path, head),
+        }
+
+    def snapshot(self):
+        """Refresh the index and return a copy of its entries."""
+        self.refresh()
+        return dict(self.entries)
+
+    def fingerprint(self, directory, entries=None, exclude=()):
+        """Hash of the names, contents and mtimes of the files directly in `directory`."""
+        entries = self.entries if entries is None else entries
+        digest = hashlib.sha256()
+        for key, entry in sorted(entries.items()):
+            if os.path.dirname(key) == directory and key not in exclude:
+                digest.update(f"{key}\0{entry['sha256']}\0{entry['mtime_ns']}\n".encode())
+        return digest.hexdigest()
+
+    async def watch(self):
+        while True:
+            try:
+                changed = await asyncio.to_thread(self.refresh)
+                if changed:
+                    logging.debug(f"Data index updated, {changed} paths changed")
+            except Exception as e:
+                logging.error(f"Could not refresh data index: {str(e)}")
+            await asyncio.sleep(config["index_poll_seconds"])
+
+    def list(self, prefix="", offset=0, limit=100):
+        entries = [
+            {k: v for k, v in entry.items() if k != "mtime_ns"}
+            for key, entry in sorted(self.entries.items())
+            if key.startswith(prefix)
+        ]
+        return {
+            "total": len(entries),
+            "offset": offset,
+            "limit": limit,
+            "refreshed_at": self.refreshed_at,
+            "entries": entries[offset:offset + limit],
+        }
+
+    def context(self):
+        """Summarize the index in a few lines for the planning prompt."""
+        directories = {}
+        for key, entry in sorted(self.entries.items()):
+            directories.setdefault(os.path.dirname(key), []).append(entry)
+        lines = []
+        for directory, entries in directories.items():
+            if len(entries) > config["index_context_dir_limit"]:
+                types = {}
+                for entry in entries:
+                    types[entry["type"]] = types.get(entry["type"], 0) + 1
+                newest = max(entries, key=lambda entry: entry["mtime"])
+                counts = ", ".join(f"{count} {file_type}" for file_type, count in sorted(types.items()))
+                lines.append(f"{directory}/ ({len(entries)} files: {counts}; newest {os.path.basename(newest['path'])})")
+                continue
+            for entry in entries:
+                modified = datetime.fromtimestamp(entry["mtime"]).isoformat(timespec="seconds")
+                lines.append(f"{entry['path']} {entry['size']}B {modified} {entry['type']}")
+        if len(lines) > config["index_context_lines"]:
+            hidden = len(lines) - config["index_context_lines"]
+            lines = lines[:config["index_context_lines"]] + [f"... {hidden} more"]
+        return "\n".join(lines) or "(empty)"
+
+
+data_index = DataIndex(config["root"])
+
+
+class ResultMemo:
+    """
+    Memo of successful executions keyed on the normalized task text.
+
+    An entry records the content hash of every /data file the script opened
+    (or its absence), a fingerprint of every directory it listed, and the
+    files it created or changed, whose contents are kept as blobs. Because
+    reads done in native code (sqlite ATTACH, duckdb, pyarrow) bypass the
+    audit hook, the entry also keeps a digest of every other /data file. A
+    later identical task gets the outputs restored without planning or
+    executing anything only if that digest and its recorded inputs still
+    match; otherwise the entry is dropped.
+
+    Runs that started other processes, deleted files or overlapped with
+    another execution are not memoized, because their effects on /data
+    cannot be attributed reliably. Neither are runs that connected anywhere
+    but the task runner itself, since their outputs depend on more than
+    /data.
+    """
+
+    def __init__(self, root, max_entries):
+        self.root = Path(root)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.active = {}
+        self.active_lock = threading.Lock()
+        self.lock = threading.Lock()
+        try:
+            with open(self.root / "memo.json", "r") as f:
+                self.entries = OrderedDict(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not load result memo: {str(e)}")
+
+    @staticmethod
+    def enabled():
+        return config["memo_enabled"] and config["index_enabled"]
+
+    @staticmethod
+    def key(task):
+        return hashlib.sha256(" ".join(task.split()).encode()).hexdigest()
+
+    def begin(self):
+        """Mark the start of an execution that may write /data."""
+        token = object()
+        with self.active_lock:
+            for other in self.active:
+                self.active[other] = True
+            self.active[token] = bool(self.active)
+        return token
+
+    def end(self, token):
+        """Return whether the execution overlapped with any other."""
+        with self.active_lock:
+            return self.active.pop(token)
+
+    def overlapped(self, token):
+        return self.active.get(token, True)
+
+    def record(self, task, before, audit, token):
+        """
+        Memoize a successful run. `token` must still be active: the run is
+        skipped if it overlapped with another execution up to the point its
+        outputs have been copied.
+        """
+        try:
+            with open(audit, "r") as f:
+                access = json.load(f)
+        except (OSError, ValueError):
+            return
+        if access["spawned"] or access.get("network"):
+            return
+        after = data_index.snapshot()
+        if self.overlapped(token) or before.keys() - after.keys():
+            return
+        outputs = {
+            path: entry["sha256"]
+            for path, entry in after.items()
+            if path not in before or before[path]["sha256"] != entry["sha256"]
+        }
+        inputs = {path: before[path]["sha256"] if path in before else None for path in access["opened"] if path not in outputs or path in before}
+        # A script's own outputs may land in a directory it listed; they are
+        # left out so restoring them does not invalidate the entry.
+        directories = {path: data_index.fingerprint(path, before, outputs) for path in access["listed"]}
+        with self.lock:
+            blobs = self.root / "blobs"
+            blobs.mkdir(parents=True, exist_ok=True)
+            for path, digest in outputs.items():
+                if not (blobs / digest).exists():
+                    shutil.copyfile(path, blobs / f"{digest}.tmp")
+                    os.replace(blobs / f"{digest}.tmp", blobs / digest)
+            if self.overlapped(token):
+                # An output may have been rewritten while it was copied.
+                return
+            key = self.key(task)
+            self.entries[key] = {
+                "inputs": inputs,
+                "directories": directories,
+                "outputs": outputs,
+                "data_digest": self.data_digest(before, outputs),
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.save()
+
+    def restore(self, task):
+        """
+        Restore the outputs of a memoized run if all its inputs are unchanged.
+        Returns the restored paths, or None on a miss.
+        """
+        key = self.key(task)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            current = data_index.snapshot()
+            valid = entry.get("data_digest") == self.data_digest(current, entry["outputs"]) and all(
+                (current[path]["sha256"] if path in current else None) == digest
+                for path, digest in entry["inputs"].items()
+            ) and all(
+                data_index.fingerprint(path, current, entry["outputs"]) == fingerprint
+                for path, fingerprint in entry["directories"].items()
+            )
+            blobs = self.root / "blobs"
+            if not valid or not all((blobs / digest).exists() for digest in entry["outputs"].values()):
+                del self.entries[key]
+                self.save()
+                return None
+            self.entries.move_to_end(key)
+            restored = []
+            # Restoring writes /data, so it counts as an overlapping execution.
+            token = self.begin()
+            try:
+                for path, digest in entry["outputs"].items():
+                    if path in current and current[path]["sha256"] == digest:
+                        continue
+                    Path(path).parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copyfile(blobs / digest, path)
+                    restored.append(path)
+            finally:
+                self.end(token)
+            return restored
+
+    @staticmethod
+    def data_digest(entries, outputs):
+        """Hash of the path and content of every /data file except the outputs."""
+        digest = hashlib.sha256()
+        for path, entry in sorted(entries.items()):
+            if path not in outputs:
+                digest.update(f"{path}\0{entry['sha256']}\n".encode())
+        return digest.hexdigest()
+
+    def save(self):
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            with open(self.root / "memo.json.tmp", "w") as f:
+                json.dump(self.entries, f)
+            os.replace(self.root / "memo.json.tmp", self.root / "memo.json")
+            referenced = {digest for entry in self.entries.values() for digest in entry["outputs"].values()}
+            for blob in (self.root / "blobs").glob("*"):
+                if blob.name not in referenced and not blob.name.endswith(".tmp"):
+                    blob.unlink(missing_ok=True)
+        except OSError as e:
+            logging.error(f"Could not persist result memo: {str(e)}")
+
+
+result_memo = ResultMemo(config["memo_root"], config["memo_size"])
+
+
+@app.get("/list")
+def list_files(
+    prefix: str = Query("", description="Only list paths under this prefix, e.g. /data/logs/"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Paginated listing of /data with size, mtime, content hash and sniffed type."""
+    if not config["index_enabled"]:
+        raise HTTPException(status_code=404, detail="The data index is disabled")
+    if prefix:
+        prefix = str(resolve_data_path(prefix)) + ("/" if prefix.endswith("/") else "")
+    return data_index.list(prefix, offset, limit)
+
+
+def resolve_data_path(path):
+    """
+    Resolve a path relative to /data (or absolute under /data) and make sure
+    it does not escape the data root.
+    """
+    # Handle both relative and absolute paths
+    if path.startswith("/data"):
+        file_path = Path(path)
+    else:
+        file_path = Path(config["root"]) / path
+    
+    # Normalize the path to prevent directory traversal
+    file_path = file_path.resolve()
+    
+    # Verify the path is within the allowed directory
+    if not str(file_path).startswith(str(Path(config["root"]).resolve())):
+        raise HTTPException(status_code=403, detail="Access to this path is not allowed")
+    return file_path
+
+
+def guess_media_type(file_path):
+    media_type, _ = mimetypes.guess_type(file_path.name)
+    if media_type is None:
+        with open(file_path, "rb") as f:
+            media_type = "application/octet-stream" if b"\0" in f.read(1024) else "text/plain"
+    if media_type.startswith("text/") or media_type in ("application/json", "application/xml"):
+        media_type += "; charset=utf-8"
+    return media_type
+
+
+def parse_range(range_header, size):
+    """
+    Parse a single `bytes=` range into an inclusive (start, end) pair.
+
+    Returns None when the header should be ignored (malformed or multiple
+    ranges) and raises 416 when the range cannot be satisfied.
+    """
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", range_header)
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+    return start, end
+
+
+def iter_file(file, start, length, compress=False):
+    """Yield `length` bytes of an open file from `start`, optionally gzipped."""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(config["read_chunk_size"], length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield compressor.compress(chunk) if compressor else chunk
+        if compressor:
+            yield compressor.flush()
+    finally:
+        file.close()
+
+
+def not_modified(request, etag, mtime):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/").replace("-gzip\"", "\"") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@app.get("/read")
+def read_file(request: Request, path: str = Query(..., description="Path to the file to read")):
+    """
+    Read the content of a file from the specified path.
+
+    The file is streamed in chunks and may be binary. Supports single `Range`
+    requests, conditional GET via ETag / Last-Modified and gzip encoding when
+    the client accepts it.
+    
+    Args:
+        path (str): Path to the file relative to /data or absolute path
         
-        # Verify the path is within the allowed directory
-        if not str(file_path).startswith(str(Path(config["root"]).resolve())):
-            raise HTTPException(status_code=403, detail="Access to this path is not allowed")
+    Returns:
+        StreamingResponse: Content of the file if found (206 for ranges, 304 if unchanged)
+        HTTPException: 404 if file not found
+    """
+    try:
+        file_path = resolve_data_path(path)
         
         # Log the resolved path for debugging
         logging.debug(f"Resolved file path: {file_path}")
@@ -267,22 +3113,222 @@ def read_file(path: str = Query(..., description="Path to the file to read")):
             logging.error(f"Path is a directory: {file_path}")
             raise HTTPException(status_code=400, detail="Path points to a directory")
             
-        # Read and return file content
+        # Stream the file content
         try:
-            with open(file_path, "r") as file:
-                content = file.read()
-            return PlainTextResponse(content)
+            stat = file_path.stat()
+            etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            headers = {
+                "ETag": etag,
+                "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+                "Accept-Ranges": "bytes",
+                "Vary": "Accept-Encoding",
+            }
+            if not_modified(request, etag, stat.st_mtime):
+                return Response(status_code=304, headers=headers)
+
+            media_type = guess_media_type(file_path)
+            start, length, status_code = 0, stat.st_size, 200
+            range_header = request.headers.get("range")
+            if_range = request.headers.get("if-range")
+            if range_header and (if_range is None or if_range == etag):
+                byte_range = parse_range(range_header, stat.st_size)
+                if byte_range:
+                    start, end = byte_range
+                    length, status_code = end - start + 1, 206
+                    headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+
+            compress = (
+                config["read_gzip"]
+                and status_code == 200
+                and stat.st_size >= config["read_gzip_min_bytes"]
+                and not media_type.startswith(("image/", "audio/", "video/", "application/zip", "application/gzip"))
+                and "gzip" in request.headers.get("accept-encoding", "")
+            )
+            if compress:
+                headers["Content-Encoding"] = "gzip"
+                headers["ETag"] = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}-gzip"'
+            else:
+                headers["Content-Length"] = str(length)
+
+            file = open(file_path, "rb")
+            return StreamingResponse(
+                iter_file(file, start, length, compress),
+                status_code=status_code,
+                media_type=media_type,
+                headers=headers,
+            )
         except PermissionError:
             logging.error(f"Permission denied for file: {file_path}")
             raise HTTPException(status_code=403, detail="Permission denied")
+        except HTTPException:
+            raise
         except Exception as e:
             logging.error(f"Error reading file {file_path}: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
             
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error processing file request: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+
+class BulkReadRequest(BaseModel):
+    paths: List[str] = []
+    glob: str = Field(None, description="Pattern relative to /data, e.g. **/*.json")
+    format: Literal["json", "tar", "zip"] = "json"
+    compress: bool = False
+
+
+def resolve_bulk_paths(request):
+    """
+    Validate every requested path in one pass.
+
+    Returns (files, errors): files maps the requested name to its resolved
+    path and stat, errors maps it to a {"status_code", "detail"} dict.
+    """
+    root = Path(config["root"]).resolve()
+    names = list(dict.fromkeys(request.paths))
+    if request.glob:
+        if request.glob.startswith("/") or ".." in Path(request.glob).parts:
+            raise HTTPException(status_code=400, detail="Glob must be relative to /data")
+        # Only regular files: directories matched by the glob are not errors.
+        matched = [path for path in sorted(root.glob(request.glob)) if path.is_file()]
+        names += [name for name in (str(path.relative_to(root)) for path in matched) if name not in names]
+    if not names:
+        raise HTTPException(status_code=400, detail="Give paths or a glob")
+    if len(names) > config["read_bulk_max_files"]:
+        raise HTTPException(status_code=413, detail=f"At most {config['read_bulk_max_files']} files per request")
+    files, errors = {}, {}
+    for name in names:
+        try:
+            file_path = resolve_data_path(name)
+            stat = file_path.stat()
+            if not S_ISREG(stat.st_mode):
+                errors[name] = {"status_code": 400, "detail": "Path points to a directory"}
+                continue
+            files[name] = (file_path, stat)
+        except HTTPException as e:
+            errors[name] = {"status_code": e.status_code, "detail": e.detail}
+        except FileNotFoundError:
+            errors[name] = {"status_code": 404, "detail": "File not found"}
+        except PermissionError:
+            errors[name] = {"status_code": 403, "detail": "Permission denied"}
+        except OSError as e:
+            errors[name] = {"status_code": 500, "detail": f"Error reading file: {str(e)}"}
+    return files, errors
+
+
+def read_entry(file_path, stat):
+    with open(file_path, "rb") as f:
+        data = f.read()
+    entry = {"size": len(data), "etag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'}
+    try:
+        entry.update(encoding="utf-8", content=data.decode("utf-8"))
+    except UnicodeDecodeError:
+        entry.update(encoding="base64", content=base64.b64encode(data).decode("ascii"))
+    return entry
+
+
+class ChunkWriter:
+    """Write-only file object collecting what tarfile / zipfile write, for streaming."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+
+def iter_archive(files, errors, archive_format, compress):
+    """
+    Yield a tar or zip archive of the files, one member at a time, so only one
+    file is held in memory. Per-file errors are added as _errors.json.
+    """
+    root = Path(config["root"]).resolve()
+    writer = ChunkWriter()
+    if archive_format == "tar":
+        archive = tarfile.open(fileobj=writer, mode="w|gz" if compress else "w|")
+    else:
+        archive = zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+    with archive:
+        for name, (file_path, stat) in files.items():
+            arcname = str(file_path.relative_to(root))
+            try:
+                if archive_format == "tar":
+                    info = tarfile.TarInfo(arcname)
+                    info.size, info.mtime, info.mode = stat.st_size, stat.st_mtime, 0o644
+                    with open(file_path, "rb") as f:
+                        archive.addfile(info, f)
+                else:
+                    archive.write(file_path, arcname)
+            except OSError as e:
+                errors[name] = {"status_code": 500, "detail": f"Error reading file: {str(e)}"}
+            yield writer.take()
+        if errors:
+            data = json.dumps(errors, indent=2).encode()
+            if archive_format == "tar":
+                info = tarfile.TarInfo("_errors.json")
+                info.size, info.mtime, info.mode = len(data), time.time(), 0o644
+                archive.addfile(info, io.BytesIO(data))
+            else:
+                archive.writestr("_errors.json", data)
+    yield writer.take()
+
+
+@app.post("/read/batch")
+async def read_files(request: Request, body: BulkReadRequest):
+    """
+    Read many files under /data in one round trip.
+
+    Takes explicit `paths` and/or a `glob` relative to /data. With
+    format=json (the default) the response maps each requested path to its
+    content (utf-8 text, or base64 for binary files) or to an error. With
+    format=tar or zip the files are streamed as an archive, per-file errors
+    going into `_errors.json`; `compress` gzips the tar or deflates the zip
+    members. JSON responses are gzipped when the client accepts it.
+    """
+    files, errors = resolve_bulk_paths(body)
+    if body.format != "json":
+        media_type = {"tar": "application/gzip" if body.compress else "application/x-tar", "zip": "application/zip"}[body.format]
+        extension = {"tar": "tar.gz" if body.compress else "tar", "zip": "zip"}[body.format]
+        return StreamingResponse(
+            iter_archive(files, errors, body.format, body.compress),
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="data.{extension}"', "X-Read-Errors": str(len(errors))},
+        )
+
+    total = sum(stat.st_size for _, stat in files.values())
+    if total > config["read_bulk_max_json_bytes"]:
+        raise HTTPException(status_code=413, detail=f"Files total {total} bytes; use format=tar or zip above {config['read_bulk_max_json_bytes']} bytes")
+    semaphore = asyncio.Semaphore(config["read_bulk_concurrency"])
+
+    async def read(name, file_path, stat):
+        async with semaphore:
+            try:
+                return name, await asyncio.to_thread(read_entry, file_path, stat)
+            except OSError as e:
+                return name, {"error": {"status_code": 500, "detail": f"Error reading file: {str(e)}"}}
+
+    with span("read_batch"):
+        entries = dict(await asyncio.gather(*(read(name, *value) for name, value in files.items())))
+    entries.update((name, {"error": error}) for name, error in errors.items())
+    content = json.dumps({"files": entries, "errors": sum("error" in entry for entry in entries.values())}).encode()
+    headers = {"Vary": "Accept-Encoding"}
+    if config["read_gzip"] and len(content) >= config["read_gzip_min_bytes"] and "gzip" in request.headers.get("accept-encoding", ""):
+        content = gzip.compress(content, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content, media_type="application/json", headers=headers)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8090)
@@ -8,6 +8,8 @@
 #     "python-dateutil",
 # ]
 # ///
+import asyncio
+import contextvars
 import hashlib
 import httpx
 import json
@@ -16,6 +18,7 @@ import numpy as np
 import os
 import re
 import subprocess
+import time
 from dateutil.parser import parse
 from datagen import (
     get_markdown,
@@ -33,6 +36,17 @@ from datagen import (
 openai_api_base = os.getenv("OPENAI_API_BASE", "https://aiproxy.sanand.workers.dev/openai/v1")
 openai_api_key = os.getenv("OPENAI_API_KEY")
 
+# Shared HTTP client, created in __main__ so every request reuses connections.
+client: httpx.AsyncClient = None
+# Seconds spent in run() and read() by the task currently being evaluated.
+timings = contextvars.ContextVar("timings", default=None)
+
+
+def record_timing(kind: str, seconds: float):
+    current = timings.get()
+    if current is not None:
+        current[kind] += seconds
+
 
 def num(str):
     return int(hashlib.sha256(str.encode()).hexdigest(), 16) % (2**32)
@@ -44,26 +58,32 @@ def mismatch(msg, expected, result):
 
 
 async def run(task: str):
-    async with httpx.AsyncClient(timeout=30) as client:
-        logging.warning(f"🟡 Running task: {task.strip()}")
+    logging.warning(f"🟡 Running task: {task.strip()}")
+    start = time.perf_counter()
+    try:
         response = await client.post("http://localhost:8000/run", params={"task": task})
-        try:
-            response_text = json.dumps(response.json(), indent=2)
-        except json.JSONDecodeError:
-            response_text = response.text
-        if response.status_code < 400:
-            logging.info(f"🟢 HTTP {response.status_code} {response_text}")
-        else:
-            logging.error(f"🔴 HTTP {response.status_code} {response_text}")
-        return response.status_code, response_text
+    finally:
+        record_timing("run", time.perf_counter() - start)
+    try:
+        response_text = json.dumps(response.json(), indent=2)
+    except json.JSONDecodeError:
+        response_text = response.text
+    if response.status_code < 400:
+        logging.info(f"🟢 HTTP {response.status_code} {response_text}")
+    else:
+        logging.error(f"🔴 HTTP {response.status_code} {response_text}")
+    return response.status_code, response_text
 
 
 async def read(path: str):
-    async with httpx.AsyncClient(timeout=30) as client:
+    start = time.perf_counter()
+    try:
         response = await client.get(f"http://localhost:8000/read?path={path}")
-        if response.status_code != 200:
-            raise Exception(f"Cannot read {path}")
-        return response.text
+    finally:
+        record_timing("read", time.perf_counter() - start)
+    if response.status_code != 200:
+        raise Exception(f"Cannot read {path}")
+    return response.text
 
 
 async def a1(email: str, **kwargs):
@@ -192,12 +212,11 @@ async def a8(email, **kwargs):
 
 async def a9(email, **kwargs):
     data = get_comments(email)
-    async with httpx.AsyncClient(timeout=30) as client:
-        response = await client.post(
-            f"{openai_api_base}/embeddings",
-            headers={"Authorization": f"Bearer {openai_api_key}"},
-            json={"model": "text-embedding-3-small", "input": data},
-        )
+    response = await client.post(
+        f"{openai_api_base}/embeddings",
+        headers={"Authorization": f"Bearer {openai_api_key}"},
+        json={"model": "text-embedding-3-small", "input": data},
+    )
     embeddings = np.array([emb["embedding"] for emb in response.json()["data"]])
     similarity = np.dot(embeddings, embeddings.T)
     # Create mask to ignore diagonal (self-similarity)
@@ -232,9 +251,12 @@ async def a10(email, **kwargs):
     return True
 
 
+TASKS = [a1, a2, a3, a4, a5, a6, a7, a8, a9, a10]
+
+
 async def main(email: str):
     score, total = 0, 0
-    for task in [a1, a2, a3, a4, a5, a6, a7, a8, a9, a10]:
+    for task in TASKS:
         total += 1
         try:
             success = await task(email=email)
@@ -249,14 +271,121 @@ async def main(email: str):
     logging.info(f"🎯 Score: {score} / {total}")
 
 
+async def timed(task, email: str, repeat: int):
+    """Evaluate one task, splitting its wall time into /run and /read time."""
+    current = {"run": 0.0, "read": 0.0}
+    timings.set(current)
+    start = time.perf_counter()
+    error = None
+    try:
+        success = bool(await task(email=email))
+    except Exception as e:
+        logging.error(f"🔴 {task.__name__.upper()} failed: {e}")
+        success, error = False, str(e)
+    return {
+        "task": task.__name__,
+        "email": email,
+        "repeat": repeat,
+        "success": success,
+        "wall": time.perf_counter() - start,
+        "run": current["run"],
+        "read": current["read"],
+        "error": error,
+    }
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(values),
+        "mean": round(float(np.mean(values)), 4),
+        "p50": round(float(p50), 4),
+        "p95": round(float(p95), 4),
+        "p99": round(float(p99), 4),
+        "max": round(float(np.max(values)), 4),
+    }
+
+
+async def benchmark(emails: list, tasks: list, concurrency: int, repeat: int):
+    """
+    Run the task suite `repeat` times per seed email and return a JSON report.
+
+    a1 generates /data, so it runs alone first; the remaining tasks run
+    concurrently, at most `concurrency` at a time. Emails and repeats run one
+    after another because they share the same /data.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(task, email, i):
+        async with semaphore:
+            return await timed(task, email, i)
+
+    results = []
+    start = time.perf_counter()
+    for email in emails:
+        for i in range(repeat):
+            rest = [task for task in tasks if task is not a1]
+            if a1 in tasks:
+                results.append(await timed(a1, email, i))
+            results += await asyncio.gather(*(bounded(task, email, i) for task in rest))
+    total_seconds = time.perf_counter() - start
+
+    per_task = {}
+    for task in tasks:
+        rows = [r for r in results if r["task"] == task.__name__]
+        per_task[task.__name__] = {
+            "passed": sum(r["success"] for r in rows),
+            "total": len(rows),
+            **{kind: percentiles([r[kind] for r in rows]) for kind in ("wall", "run", "read")},
+        }
+    return {
+        "emails": emails,
+        "tasks": [task.__name__ for task in tasks],
+        "concurrency": concurrency,
+        "repeat": repeat,
+        "total_seconds": round(total_seconds, 4),
+        "passed": sum(r["success"] for r in results),
+        "total": len(results),
+        "summary": {kind: percentiles([r[kind] for r in results]) for kind in ("wall", "run", "read")},
+        "per_task": per_task,
+        "results": results,
+    }
+
+
+async def evaluate(args):
+    global client
+    async with httpx.AsyncClient(timeout=args.timeout) as client:
+        if not args.benchmark:
+            return await main(args.email)
+        tasks = [task for task in TASKS if not args.tasks or task.__name__ in args.tasks]
+        report = await benchmark(args.emails or [args.email], tasks, args.concurrency, args.repeat)
+        wall = report["summary"]["wall"]
+        logging.info(
+            f"🎯 Passed {report['passed']} / {report['total']} in {report['total_seconds']:.2f}s "
+            f"(p50 {wall.get('p50', 0):.2f}s, p95 {wall.get('p95', 0):.2f}s, p99 {wall.get('p99', 0):.2f}s)"
+        )
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(report, f, indent=2)
+            logging.info(f"📄 Report written to {args.report}")
+
+
 if __name__ == "__main__":
-    import asyncio
     import argparse
 
     parser = argparse.ArgumentParser(description="Evaluate tasks with configurable logging")
     parser.add_argument("--email", default="user@example.com", help="Set the email address")
     levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
     parser.add_argument("--log-level", default="INFO", choices=levels, help="Set logging level")
+    parser.add_argument("--timeout", type=float, default=30, help="HTTP timeout in seconds")
+    parser.add_argument("--benchmark", action="store_true", help="Time every task and report latency percentiles")
+    parser.add_argument("--concurrency", type=int, default=1, help="Tasks evaluated in parallel after a1 (benchmark)")
+    parser.add_argument("--repeat", type=int, default=1, help="Times to run the suite per email (benchmark)")
+    parser.add_argument("--emails", nargs="+", help="Seed emails to benchmark with (defaults to --email)")
+    parser.add_argument("--tasks", nargs="+", help="Only run these tasks, e.g. a3 a4 (benchmark)")
+    parser.add_argument("--report", help="Write the benchmark report as JSON to this file")
     args = parser.parse_args()
     logging.basicConfig(level=args.log_level, format="%(message)s\n")
-    asyncio.run(main(args.email))
+    asyncio.run(evaluate(args))
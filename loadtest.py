@@ -0,0 +1,164 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#     "httpx",
+#     "numpy",
+# ]
+# ///
+
+# Drives /run at a target request rate and reports throughput, error rates and
+# latency percentiles. Requests are sent open-loop (on schedule, whether or not
+# earlier ones finished), so a server that cannot keep up shows growing
+# latency instead of a silently lower request rate. Pair it with mock_llm.py to
+# measure the task runner without the live LLM:
+#
+#   uv run loadtest.py --rps 20 --duration 60 --task "Count the lines in /data/logs.txt"
+
+import asyncio
+import httpx
+import json
+import logging
+import numpy as np
+import random
+import re
+import time
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    p50, p90, p95, p99 = np.percentile(values, [50, 90, 95, 99])
+    return {
+        "count": len(values),
+        "mean": round(float(np.mean(values)), 4),
+        "p50": round(float(p50), 4),
+        "p90": round(float(p90), 4),
+        "p95": round(float(p95), 4),
+        "p99": round(float(p99), 4),
+        "max": round(float(np.max(values)), 4),
+    }
+
+
+def server_timing(header: str):
+    """Phase durations in seconds from a Server-Timing header."""
+    phases = {}
+    for match in re.finditer(r"([\w-]+);dur=([\d.]+)", header or ""):
+        phases[match.group(1)] = phases.get(match.group(1), 0.0) + float(match.group(2)) / 1000
+    return phases
+
+
+async def send(client: httpx.AsyncClient, url: str, task: str, params: dict, scheduled: float, start: float):
+    sent = time.perf_counter()
+    result = {"task": task, "scheduled": round(scheduled - start, 4), "lag": round(sent - scheduled, 4)}
+    try:
+        response = await client.post(url, params={"task": task, **params})
+        result["status"] = response.status_code
+        result["phases"] = server_timing(response.headers.get("server-timing"))
+        if response.status_code >= 400:
+            result["error"] = response.text[:200]
+    except httpx.HTTPError as e:
+        result["status"] = type(e).__name__
+        result["error"] = str(e)[:200]
+    result["latency"] = round(time.perf_counter() - sent, 4)
+    return result
+
+
+async def loadtest(args, tasks: list):
+    """
+    Send requests at `args.rps` for `args.duration` seconds and return a JSON
+    report. Arrivals are evenly spaced, or exponentially distributed with
+    --poisson. At most --max-in-flight requests are outstanding; requests
+    that would exceed it are counted as dropped rather than queued.
+    """
+    params = {"no_cache": "true"} if args.no_cache else {}
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    pending, results, dropped = set(), [], 0
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        scheduled = start
+        while scheduled - start < args.duration:
+            await asyncio.sleep(max(scheduled - time.perf_counter(), 0))
+            if len(pending) >= args.max_in_flight:
+                dropped += 1
+            else:
+                request = asyncio.create_task(send(client, args.endpoint, random.choice(tasks), params, scheduled, start))
+                pending.add(request)
+                request.add_done_callback(lambda r: (pending.discard(r), results.append(r.result())))
+            scheduled += random.expovariate(args.rps) if args.poisson else 1 / args.rps
+        await asyncio.gather(*pending)
+        total_seconds = time.perf_counter() - start
+
+    ok, failed = [], []
+    for r in results:
+        (ok if isinstance(r["status"], int) and r["status"] < 400 else failed).append(r)
+    statuses = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    phases = {}
+    for r in ok:
+        for phase, seconds in r.get("phases", {}).items():
+            phases.setdefault(phase, []).append(seconds)
+    return {
+        "url": args.url + args.endpoint,
+        "target_rps": args.rps,
+        "duration": args.duration,
+        "total_seconds": round(total_seconds, 4),
+        "sent": len(results),
+        "dropped": dropped,
+        "succeeded": len(ok),
+        "achieved_rps": round(len(results) / args.duration, 4),
+        "throughput": round(len(ok) / total_seconds, 4),
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0,
+        "statuses": statuses,
+        "latency": percentiles([r["latency"] for r in ok]),
+        "failed_latency": percentiles([r["latency"] for r in failed]),
+        "send_lag": percentiles([r["lag"] for r in results]),
+        "phases": {phase: percentiles(values) for phase, values in sorted(phases.items())},
+        "results": results if args.verbose_report else [],
+    }
+
+
+def main(args):
+    tasks = list(args.task or [])
+    if args.tasks_file:
+        with open(args.tasks_file) as f:
+            tasks += [line.strip() for line in f if line.strip()]
+    if not tasks:
+        raise SystemExit("Give at least one --task or a --tasks-file")
+    random.seed(args.seed)
+    report = asyncio.run(loadtest(args, tasks))
+    latency = report["latency"]
+    logging.info(
+        f"🎯 {report['succeeded']} / {report['sent']} succeeded ({report['dropped']} dropped), "
+        f"{report['throughput']:.2f} req/s at target {args.rps} req/s, errors {report['error_rate']:.1%} "
+        f"(p50 {latency.get('p50', 0):.2f}s, p95 {latency.get('p95', 0):.2f}s, p99 {latency.get('p99', 0):.2f}s)"
+    )
+    logging.info(f"📊 Status codes: {report['statuses']}")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"📄 Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load test the task runner at a target request rate")
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL of the task runner")
+    parser.add_argument("--endpoint", default="/run", help="Endpoint to POST tasks to")
+    parser.add_argument("--task", action="append", help="Task to send (repeat to mix several)")
+    parser.add_argument("--tasks-file", help="File with one task per line")
+    parser.add_argument("--rps", type=float, default=5, help="Target requests per second")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to keep sending requests")
+    parser.add_argument("--poisson", action="store_true", help="Exponential inter-arrival times instead of a fixed rate")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Drop requests beyond this many outstanding")
+    parser.add_argument("--no-cache", action="store_true", help="Send no_cache=true so every request plans and executes")
+    parser.add_argument("--timeout", type=float, default=120, help="HTTP timeout in seconds")
+    parser.add_argument("--seed", type=int, help="Seed task choice and arrival times")
+    parser.add_argument("--report", help="Write the report as JSON to this file")
+    parser.add_argument("--verbose-report", action="store_true", help="Include every request in the report")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"])
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(message)s\n")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    main(args)
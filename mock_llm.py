@@ -0,0 +1,200 @@
+# /// script
+# requires-python = ">=3.11"
+# dependencies = [
+#   "httpx",
+#   "fastapi",
+#   "uvicorn"
+# ]
+# ///
+
+# Local stand-in for the OpenAI-compatible chat completions API used by app.py,
+# so the task runner can be load tested offline:
+#
+#   uv run mock_llm.py --recordings answers.jsonl --latency 0.8 --error-rate 0.02
+#   LLM_BASE_URL=http://localhost:8001/v1 AIPROXY_TOKEN=mock uv run app.py
+#
+# Recordings are JSON lines of {"match": <regex>, "kind": "plan" | "repair",
+# "content": {"python_code": ..., "python_dependencies": [...]}}. A request is
+# answered with the first recording whose pattern matches the user message
+# (and whose kind matches, when given); unmatched requests get the recordings
+# without a pattern in turn, or a script that just prints "ok". With
+# --upstream, requests are forwarded to a real API instead and its answers
+# appended to the recordings file.
+
+import httpx
+import asyncio
+import os
+import json
+import random
+import re
+import time
+import itertools
+import hashlib
+import logging
+import argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+logging.basicConfig(level=logging.INFO)
+
+app = FastAPI()
+
+settings = {
+    "recordings": None,
+    "upstream": None,
+    "latency": 0.5,
+    "jitter": 0.2,
+    "error_rate": 0.0,
+    "rate_limit_rate": 0.0,
+    "timeout_rate": 0.0,
+    "timeout_seconds": 60.0,
+    "malformed_rate": 0.0,
+    "seed": None,
+}
+recordings = []
+DEFAULT_CONTENT = {"python_code": "print('ok')\n", "python_dependencies": []}
+EMBEDDING_DIMENSIONS = 256
+fallbacks = itertools.cycle([{"content": DEFAULT_CONTENT}])
+stats = {"requests": 0, "replayed": 0, "recorded": 0, "fallback": 0, "errors": 0, "rate_limited": 0, "timeouts": 0, "malformed": 0}
+
+
+def load_recordings(path):
+    global fallbacks
+    recordings.clear()
+    if path and os.path.exists(path):
+        with open(path, "r") as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    recording = json.loads(line)
+                    recording["pattern"] = re.compile(recording["match"], re.IGNORECASE | re.DOTALL) if recording.get("match") else None
+                    recordings.append(recording)
+                except (ValueError, KeyError, re.error) as e:
+                    logging.error(f"Skipping recording on line {number}: {str(e)}")
+    fallbacks = itertools.cycle([r for r in recordings if r["pattern"] is None] or [{"content": DEFAULT_CONTENT}])
+    logging.info(f"Loaded {len(recordings)} recordings from {path}")
+
+
+def request_kind(body):
+    """Repair requests from app.py ask to update existing code."""
+    user = next((m["content"] for m in body.get("messages", []) if m.get("role") == "user"), "")
+    return ("repair" if user.lstrip().startswith("Update this python code:") else "plan"), user
+
+
+def find_recording(kind, user):
+    for recording in recordings:
+        if recording["pattern"] is None or recording.get("kind", kind) != kind:
+            continue
+        if recording["pattern"].search(user):
+            stats["replayed"] += 1
+            return recording
+    stats["fallback"] += 1
+    return next(fallbacks)
+
+
+def completion(body, content):
+    prompt_tokens = sum(len(m.get("content", "")) for m in body.get("messages", [])) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"chatcmpl-mock-{stats['requests']}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+async def record(request, body, kind, user):
+    """Forward the request to the upstream API and append its answer to the recordings."""
+    async with httpx.AsyncClient(timeout=settings["timeout_seconds"]) as client:
+        response = await client.post(
+            f"{settings['upstream'].rstrip('/')}/chat/completions",
+            json=body,
+            headers={"Authorization": request.headers.get("authorization", "")},
+        )
+    if response.status_code == 200:
+        content = json.loads(response.json()["choices"][0]["message"]["content"])
+        task = user.split(":", 1)[-1].split("\n\nFiles currently in /data")[0].strip()
+        recording = {"match": re.escape(task[:200]), "kind": kind, "content": content}
+        if settings["recordings"]:
+            with open(settings["recordings"], "a") as f:
+                f.write(json.dumps(recording) + "\n")
+        recordings.append({**recording, "pattern": re.compile(recording["match"], re.IGNORECASE | re.DOTALL)})
+        stats["recorded"] += 1
+    return JSONResponse(response.json(), status_code=response.status_code)
+
+
+@app.post("/v1/chat/completions")
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    stats["requests"] += 1
+    body = await request.json()
+    kind, user = request_kind(body)
+    if settings["upstream"]:
+        return await record(request, body, kind, user)
+
+    delay = max(random.gauss(settings["latency"], settings["jitter"]), 0)
+    roll = random.random()
+    if roll < settings["timeout_rate"]:
+        stats["timeouts"] += 1
+        await asyncio.sleep(settings["timeout_seconds"])
+    roll -= settings["timeout_rate"]
+    await asyncio.sleep(delay)
+    if roll < settings["error_rate"]:
+        stats["errors"] += 1
+        return JSONResponse({"error": {"message": "Injected server error", "type": "server_error"}}, status_code=500)
+    roll -= settings["error_rate"]
+    if roll < settings["rate_limit_rate"]:
+        stats["rate_limited"] += 1
+        return JSONResponse({"error": {"message": "Injected rate limit", "type": "rate_limit_exceeded"}}, status_code=429, headers={"Retry-After": "1"})
+    roll -= settings["rate_limit_rate"]
+    if roll < settings["malformed_rate"]:
+        stats["malformed"] += 1
+        return completion(body, '{"python_code": "print(')
+    return completion(body, json.dumps(find_recording(kind, user)["content"]))
+
+
+@app.post("/v1/embeddings")
+@app.post("/openai/v1/embeddings")
+async def embeddings(request: Request):
+    """Deterministic pseudo-embeddings: the same text always gets the same vector."""
+    stats["requests"] += 1
+    body = await request.json()
+    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    await asyncio.sleep(max(random.gauss(settings["latency"], settings["jitter"]), 0))
+    data = []
+    for index, text in enumerate(texts):
+        rng = random.Random(hashlib.sha256(text.lower().encode()).digest())
+        data.append({"object": "embedding", "index": index, "embedding": [rng.gauss(0, 1) for _ in range(EMBEDDING_DIMENSIONS)]})
+    tokens = sum(len(text) for text in texts) // 4
+    return {"object": "list", "data": data, "model": body.get("model", "mock"), "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+
+@app.get("/stats")
+def get_stats():
+    return {**stats, "recordings": len(recordings), "settings": settings}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible LLM API replaying recorded task plans")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--recordings", help="JSON lines file of recorded answers")
+    parser.add_argument("--upstream", help="Forward to this API base (e.g. https://aiproxy.sanand.workers.dev/openai/v1) and record its answers")
+    parser.add_argument("--latency", type=float, default=settings["latency"], help="Mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=settings["jitter"], help="Standard deviation of the latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 429")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Fraction of requests that hang for --timeout-seconds")
+    parser.add_argument("--timeout-seconds", type=float, default=settings["timeout_seconds"])
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of requests answered with truncated JSON")
+    parser.add_argument("--seed", type=int, help="Seed the latency and error injection for reproducible runs")
+    args = parser.parse_args()
+    settings.update({key: value for key, value in vars(args).items() if key in settings})
+    random.seed(args.seed)
+    load_recordings(args.recordings)
+    uvicorn.run(app, host=args.host, port=args.port)